@@ -0,0 +1,150 @@
+"""
+End-to-end benchmark of the techTool.py pipeline.
+
+Runs techTool.py --profile on a bundle (an existing one, or a synthetic one built with
+gen_bundle.py) and reports the throughput (MB/s and lines/s) and the peak memory of every
+stage, best of --repeat runs. Where techTool.py cannot measure a stage's own peak (no
+/proc/self/clear_refs) the memory column is the cumulative process maximum at the end of the stage. Results can be stored as a baseline and later runs compared
+against it; the exit status is 1 when a stage is slower than the baseline by more than --tolerance.
+
+Usage:
+    python3 benchmarks/bench_pipeline.py --size_mb 200 [--repeat 3] [--save_baseline base.json]
+    python3 benchmarks/bench_pipeline.py --bundle /tmp/bundle.tar.gz --baseline base.json [--args "--jobs 4"]
+"""
+import argparse
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import gen_bundle
+
+TECHTOOL = os.path.join(BENCH_DIR, '..', 'techTool.py')
+PROFILE_REPORT = 'profile.json'
+
+
+def run_pipeline(bundle, extra_args, work_dir):
+    """Runs techTool.py once and returns (wall seconds, profile report)."""
+    output_path = os.path.join(work_dir, 'out')
+    shutil.rmtree(output_path, ignore_errors=True)
+    os.makedirs(output_path)
+    command = [sys.executable, TECHTOOL, '--tar_file', bundle, '--output_path', output_path,
+               '--expand_tree', output_path, '--profile'] + extra_args
+    started = time.perf_counter()
+    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    wall = time.perf_counter() - started
+    with open(os.path.join(output_path, PROFILE_REPORT), encoding='utf-8') as report_file:
+        return wall, json.load(report_file)
+
+def stage_results(report):
+    """Throughput and memory per stage of one profile report."""
+    results = {}
+    for record in report['stages']:
+        wall = record['wall_s'] or 0.0
+        rss_kb = record['peak_rss_kb'] if report['peak_rss_kind'] == 'interval' else record.get('max_rss_end_kb')
+        results[record['stage']] = {
+            'wall_s': wall,
+            'cpu_s': record['cpu_s'],
+            'mb_per_s': record['bytes_in'] / (1024 * 1024) / wall if record['bytes_in'] and wall else None,
+            'lines_per_s': record['lines_in'] / wall if record['lines_in'] and wall else None,
+            'peak_rss_mb': rss_kb / 1024 if rss_kb is not None else None,
+        }
+    return results
+
+def best_of(runs):
+    """Per stage, the run with the lowest wall time."""
+    best = {}
+    for results in runs:
+        for stage, result in results.items():
+            if stage not in best or result['wall_s'] < best[stage]['wall_s']:
+                best[stage] = result
+    return best
+
+def format_value(value, spec):
+    return "-" if value is None else format(value, spec)
+
+def print_results(result):
+    rss_label = 'peak RSS MB' if result['peak_rss_kind'] == 'interval' else 'max RSS MB*'
+    print(f"\nTotal wall {result['total_wall_s']:.2f}s (best of {result['repeat']})")
+    print(f"{'stage':<14} {'wall s':>8} {'cpu s':>8} {'MB/s':>9} {'lines/s':>11} {rss_label:>11}")
+    for stage, values in result['stages'].items():
+        print(f"{stage:<14} {values['wall_s']:>8.2f} {format_value(values['cpu_s'], '.2f'):>8} "
+              f"{format_value(values['mb_per_s'], '.1f'):>9} {format_value(values['lines_per_s'], ',.0f'):>11} "
+              f"{format_value(values['peak_rss_mb'], '.1f'):>11}")
+    if result['peak_rss_kind'] != 'interval':
+        print("* cumulative maximum of the process at the end of the stage, not the stage's own peak")
+
+def compare(result, baseline, tolerance):
+    """Prints the change of every stage against the baseline, returns the regressed stages."""
+    regressions = []
+    print(f"\nAgainst the baseline (tolerance {tolerance:.0%})")
+    rows = [('total', result['total_wall_s'], baseline['total_wall_s'])]
+    rows += [(stage, values['wall_s'], baseline['stages'][stage]['wall_s'])
+             for stage, values in result['stages'].items() if stage in baseline['stages']]
+    for stage, wall, base_wall in rows:
+        change = (wall - base_wall) / base_wall if base_wall else 0.0
+        # Stages of a few ms are noise, only a slowdown of at least 50 ms counts
+        regressed = change > tolerance and wall - base_wall > 0.05
+        if regressed:
+            regressions.append(stage)
+        print(f"{stage:<14} {base_wall:>8.2f}s -> {wall:>8.2f}s {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the techTool.py pipeline stage by stage.')
+    parser.add_argument('--bundle', help='Existing .tar.gz bundle to benchmark on')
+    parser.add_argument('--size_mb', type=int, default=100, help='Size of the generated bundle when --bundle is not set')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generated bundle')
+    parser.add_argument('--args', default='', help='Extra techTool.py arguments, e.g. "--jobs 4"')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs, the best time of each stage is reported')
+    parser.add_argument('--baseline', help='Baseline JSON to compare against')
+    parser.add_argument('--save_baseline', help='Write the results as a baseline JSON')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        bundle = args.bundle
+        if bundle is None:
+            bundle = os.path.join(work_dir, 'bundle.tar.gz')
+            print(f"Generating a {args.size_mb} MB bundle (seed {args.seed})")
+            gen_bundle.generate_bundle(bundle, args.size_mb, args.seed, verbose=False)
+
+        walls, runs = [], []
+        for run in range(args.repeat):
+            wall, report = run_pipeline(bundle, shlex.split(args.args), work_dir)
+            peak_rss_kind = report['peak_rss_kind']
+            walls.append(wall)
+            runs.append(stage_results(report))
+            print(f"run {run + 1}: {wall:.2f}s")
+
+    result = {
+        'bundle': args.bundle or f"generated size_mb={args.size_mb} seed={args.seed}",
+        'args': args.args,
+        'repeat': args.repeat,
+        'total_wall_s': min(walls),
+        'peak_rss_kind': peak_rss_kind,
+        'stages': best_of(runs),
+    }
+    print_results(result)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump(result, baseline_file, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('bundle') != result['bundle'] or baseline.get('args') != result['args']:
+            print(f"\nWarning: the baseline was measured on {baseline.get('bundle')} with '{baseline.get('args')}'")
+        if compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Microbenchmark of the timestamp parsing in techTool.py.
+
+Compares, for every TIMESTAMP_FORMATS entry, the strptime path used by the original
+process_lines() (parse_timestamp() + strptime year check + strftime) with the fast
+fixed-offset parsers (parse_timestamp_fast() + format_timestamp()).
+
+Usage:
+    python3 benchmarks/bench_timestamps.py [--lines 20000] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import techTool
+
+
+# One sample line layout per TIMESTAMP_FORMATS entry (the repeated 'T' pattern is a single entry)
+SAMPLE_LAYOUTS = [
+    "%Y-%m-%d %H:%M:%S,{ms} bgpd: neighbor 10.0.0.1 up",
+    "<DEBUG> %d-%b-%Y",
+    "<INFO> %d-%b-%Y",
+    "%Y-%m-%dT%H:%M:%S.{us} fib: route added",
+    "%Y-%m-%dT%H:%M:%S nsm: interface ge-0/0/1 up",
+    "%Y/%m/%d %H:%M:%S arp: entry refreshed",
+    "%Y-%m-%d %H:%M:%S.{us}; confd; commit done",
+    "|%Y-%m-%d %H:%M:%S.{ms}| bcm | counter poll",
+    "%a %b %d %H:%M:%S %Y: kernel: eth0 link up",
+    "%b %d %H:%M:%S router sshd[101]: accepted",
+    "%Y-%m-%d %H:%M:%S,{ms}.{ms} sub-millisecond trace",
+    "%Y-%m-%d %H:%M:%S plain message",
+    "|%Y-%m-%d %H:%M:%S plain piped message",
+    "%a %b %d %H:%M:%S %Y kernel message",
+    "%Y-%m-%d %H:%M:%S plain message",
+    "%b %d %H:%M:%S router cron[7]: job",
+    "<INFO> %d-%b-%Y::%H:%M:%S.{ms} info message",
+]
+
+def make_lines(layout, count):
+    start = datetime(2024, 5, 5, 13, 0, 0)
+    lines = []
+    for i in range(count):
+        moment = start + timedelta(milliseconds=i * 37)
+        lines.append(moment.strftime(layout).format(ms=f"{moment.microsecond // 1000:03d}", us=f"{moment.microsecond:06d}"))
+    return lines
+
+def strptime_path(lines):
+    current_year = datetime.now().year
+    out = []
+    for line in lines:
+        timestamp, message = techTool.parse_timestamp(line, techTool.TIMESTAMP_FORMATS)
+        if timestamp is None:
+            continue
+        timestamp_tmp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f")
+        if timestamp_tmp.year < 2000:
+            timestamp = timestamp_tmp.replace(year=current_year).strftime("%Y-%m-%d %H:%M:%S.%f") + '*'
+        out.append(timestamp)
+    return out
+
+def fast_path(lines):
+    current_year = datetime.now().year
+    out = []
+    for line in lines:
+        _, fields, message = techTool.parse_timestamp_fast(line)
+        if fields is None:
+            continue
+        if fields[0] < 2000:
+            timestamp = techTool.format_timestamp((current_year,) + fields[1:]) + '*'
+        else:
+            timestamp = techTool.format_timestamp(fields)
+        out.append(timestamp)
+    return out
+
+def best_time(function, lines, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(lines)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark strptime vs fast timestamp parsing.')
+    parser.add_argument('--lines', type=int, default=20000, help='Lines per format')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions, best time is reported')
+    args = parser.parse_args()
+
+    print(f"{'#':>2}  {'format':<26} {'strptime us/line':>17} {'fast us/line':>13} {'speedup':>8}")
+    total_slow = total_fast = 0.0
+    for index, ((_, datetime_format), layout) in enumerate(zip(techTool.TIMESTAMP_FORMAT_LIST, SAMPLE_LAYOUTS)):
+        lines = make_lines(layout, args.lines)
+        slow, slow_result = best_time(strptime_path, lines, args.repeat)
+        fast, fast_result = best_time(fast_path, lines, args.repeat)
+        if slow_result != fast_result:
+            print(f"{index:>2}  {datetime_format:<26} MISMATCH between strptime and fast parser output")
+            continue
+        total_slow += slow
+        total_fast += fast
+        print(f"{index:>2}  {datetime_format:<26} {slow / args.lines * 1e6:>17.2f} {fast / args.lines * 1e6:>13.2f} "
+              f"{slow / fast:>7.1f}x")
+    print(f"\nTotal: strptime {total_slow:.3f}s, fast {total_fast:.3f}s, speedup {total_slow / total_fast:.1f}x")
+
+if __name__ == "__main__":
+    main()
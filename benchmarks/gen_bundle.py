@@ -0,0 +1,197 @@
+"""
+Synthetic tech-support bundle generator for benchmarking techTool.py.
+
+Builds a .tar.gz with the layout of a real bundle (vbox/cpm_image/root/var/log/...,
+trace files with rotated .gz generations), one or more log files for every
+TIMESTAMP_FORMATS layout, mixed encodings (UTF-8, UTF-8 with BOM, latin-1 bytes),
+continuation lines without a timestamp and junk files matching external_list_of_files.
+The output is reproducible for a given --seed and scales from MBs to tens of GBs:
+files are generated one at a time into a temporary file and streamed into the tar.
+
+Usage:
+    python3 benchmarks/gen_bundle.py --output /tmp/bundle.tar.gz [--size_mb 100] [--seed 1]
+                                     [--start "2024-05-05 00:00:00"] [--hours 168]
+"""
+import argparse
+import gzip
+import os
+import random
+import sys
+import tarfile
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+LOG_ROOT = "vbox/cpm_image/root/var/log"
+
+# (path under the bundle, line layout, share of the bundle size, encoding, rotated .gz generations)
+# Layouts are strftime formats with {ms} / {us} fraction and {message} placeholders, there is one
+# for every TIMESTAMP_FORMATS layout (entries shadowed by an earlier pattern parse as that entry).
+LOG_FILES = [
+    (f"{LOG_ROOT}/trace/bgpd.trace", "%Y-%m-%d %H:%M:%S,{ms} bgpd: {message}", 12, 'utf-8', 2),
+    (f"{LOG_ROOT}/trace/fib.trace", "%Y-%m-%dT%H:%M:%S.{us} fib: {message}", 12, 'utf-8', 2),
+    (f"{LOG_ROOT}/trace/nsm.trace", "%Y-%m-%dT%H:%M:%S nsm: {message}", 8, 'utf-8', 1),
+    (f"{LOG_ROOT}/trace/arp.trace", "%Y/%m/%d %H:%M:%S arp: {message}", 6, 'utf-8', 1),
+    (f"{LOG_ROOT}/trace/debug_arp.trace", "<DEBUG> %d-%b-%Y", 1, 'utf-8', 0),
+    (f"{LOG_ROOT}/trace/debug_nsm.trace", "<INFO> %d-%b-%Y", 1, 'utf-8', 0),
+    (f"{LOG_ROOT}/trace/confd_trace.trace", "%Y-%m-%d %H:%M:%S.{us}; confd; {message}", 4, 'utf-8', 1),
+    (f"{LOG_ROOT}/trace/bcm_diag.trace", "|%Y-%m-%d %H:%M:%S.{ms}| bcm | {message}", 6, 'utf-8', 1),
+    (f"{LOG_ROOT}/kern.log", "%a %b %d %H:%M:%S %Y: kernel: {message}", 4, 'latin-1', 1),
+    (f"{LOG_ROOT}/messages", "%b %d %H:%M:%S cpm {message}", 6, 'utf-8', 2),
+    (f"{LOG_ROOT}/trace/pim.trace", "%Y-%m-%d %H:%M:%S,{ms}.{ms} pim: {message}", 3, 'utf-8', 0),
+    (f"{LOG_ROOT}/trace/lldp.trace", "%Y-%m-%d %H:%M:%S lldp: {message}", 3, 'utf-8', 0),
+    (f"{LOG_ROOT}/trace/ospf.trace", "|%Y-%m-%d %H:%M:%S ospf {message}", 3, 'utf-8', 0),
+    (f"{LOG_ROOT}/trace/rib.trace", "%a %b %d %H:%M:%S %Y rib {message}", 3, 'utf-8', 0),
+    (f"{LOG_ROOT}/syslog", "%b %d %H:%M:%S cpm syslog: {message}", 4, 'utf-8-sig', 1),
+    (f"{LOG_ROOT}/trace/mpls.trace", "<INFO> %d-%b-%Y::%H:%M:%S.{ms} mpls {message}", 3, 'utf-8', 0),
+    ("var/log/bcm.log", "<INFO> %d-%b-%Y::%H:%M:%S.{ms} bcm {message}", 4, 'utf-8', 1),
+]
+
+# Files techTool.py leaves out (external_list_of_files) or that are below its size limit
+JUNK_FILES = [
+    (f"{LOG_ROOT}/wtmp", 'binary', 64 * 1024),
+    (f"{LOG_ROOT}/lastlog", 'binary', 32 * 1024),
+    (f"{LOG_ROOT}/faillog", 'binary', 8 * 1024),
+    (f"{LOG_ROOT}/dmesg", 'text', 48 * 1024),
+    (f"{LOG_ROOT}/sys_profile", 'text', 16 * 1024),
+    (f"{LOG_ROOT}/trace/stats_file.csv", 'text', 32 * 1024),
+    (f"{LOG_ROOT}/sysstat/sa05", 'binary', 32 * 1024),
+    ("node-system-info.txt", 'text', 16 * 1024),
+    (f"{LOG_ROOT}/trace/empty.trace", 'text', 120),
+]
+
+WORDS = ("neighbor interface route prefix session state change up down timeout keepalive update "
+         "withdraw commit lock unlock counter poll link port vlan table entry added removed refreshed "
+         "request reply error warning retry queue").split()
+NON_ASCII_WORDS = ("café", "naïve", "Zürich", "señal", "übertragung")
+
+CONTINUATION_RATE = 0.05    # Lines without a timestamp (stack traces, wrapped output)
+NON_ASCII_RATE = 0.02       # Lines with non ASCII characters
+INVALID_UTF8_RATE = 0.001   # Lines with bytes that are not valid UTF-8
+MESSAGE_POOL = 4096         # Distinct messages per file, picked at random for each line
+
+
+def make_message(rng):
+    words = rng.choices(WORDS, k=rng.randint(3, 12))
+    if rng.random() < NON_ASCII_RATE:
+        words.append(rng.choice(NON_ASCII_WORDS))
+    return " ".join(words) + f"; id={rng.randint(0, 1 << 20)}"
+
+def write_log_lines(outfile, rng, layout, encoding, start, end, size):
+    """Writes about size bytes of lines with increasing timestamps between start and end."""
+    line_encoding = 'utf-8' if encoding == 'utf-8-sig' else encoding
+    if encoding == 'utf-8-sig':
+        outfile.write(b'\xef\xbb\xbf')
+    date_only = '{message}' not in layout
+    messages = [make_message(rng) for _ in range(MESSAGE_POOL)]
+    continuations = [f"    at {' '.join(rng.choices(WORDS, k=4))}\n" for _ in range(MESSAGE_POOL)]
+    line_count = max(1, size // (20 if date_only else 90))
+    step = 2 * (end - start).total_seconds() / line_count
+    written = 0
+    moment = start
+    prefix_second, prefix = None, None
+    batch = []
+    while written < size:
+        moment += timedelta(seconds=rng.random() * step)
+        second = moment.replace(microsecond=0)
+        if second != prefix_second:
+            prefix_second, prefix = second, moment.strftime(layout)
+        if date_only:
+            line = prefix + "\n"
+        else:
+            microsecond = moment.microsecond
+            line = prefix.format(ms=f"{microsecond // 1000:03d}", us=f"{microsecond:06d}",
+                                 message=messages[int(rng.random() * MESSAGE_POOL)]) + "\n"
+        draw = rng.random()
+        if draw < CONTINUATION_RATE:
+            line += continuations[int(rng.random() * MESSAGE_POOL)]
+        data = line.encode(line_encoding, errors='replace')
+        if draw > 1 - INVALID_UTF8_RATE:
+            data = data[:-1] + b' \xff\xfe\n'
+        batch.append(data)
+        written += len(data)
+        if len(batch) >= 4096:
+            outfile.write(b''.join(batch))
+            batch = []
+    outfile.write(b''.join(batch))
+    return written
+
+def write_junk(outfile, rng, kind, size):
+    if kind == 'binary':
+        outfile.write(rng.randbytes(size) if hasattr(rng, 'randbytes') else os.urandom(size))
+        return size
+    written = 0
+    while written < size:
+        data = (" ".join(rng.choices(WORDS, k=10)) + "\n").encode()
+        outfile.write(data)
+        written += len(data)
+    return written
+
+def add_member(tar, tmp_dir, arcname, mtime, write, compress=False):
+    """Generates one member into a temporary file with write(outfile) and streams it into the tar."""
+    path = os.path.join(tmp_dir, "member")
+    with (gzip.open(path, 'wb', compresslevel=1) if compress else open(path, 'wb')) as outfile:
+        written = write(outfile)
+    os.utime(path, (mtime, mtime))
+    tar.add(path, arcname=arcname)
+    size = os.path.getsize(path)
+    os.remove(path)
+    return written, size
+
+def generate_bundle(output, size_mb, seed=1, start="2024-05-05 00:00:00", hours=168, verbose=True):
+    """
+    Writes a synthetic bundle of about size_mb MB of uncompressed logs to output.
+    Returns the list of (member name, uncompressed bytes, stored bytes).
+    """
+    rng = random.Random(seed)
+    start_time = datetime.strptime(start, "%Y-%m-%d %H:%M:%S")
+    end_time = start_time + timedelta(hours=hours)
+    total_share = sum(share for _, _, share, _, _ in LOG_FILES)
+    budget = size_mb * 1024 * 1024
+    members = []
+    with tempfile.TemporaryDirectory() as tmp_dir, tarfile.open(output, 'w:gz', compresslevel=1) as tar:
+        for path, layout, share, encoding, rotations in LOG_FILES:
+            file_budget = budget * share // total_share
+            # The live file holds the newest period, generation N the oldest
+            generations = rotations + 1
+            period = (end_time - start_time) / generations
+            for generation in range(rotations, -1, -1):
+                period_start = start_time + period * (rotations - generation)
+                period_end = period_start + period
+                name = path if generation == 0 else f"{path}.{generation}.gz"
+                mtime = time.mktime(period_end.timetuple())
+                written, size = add_member(
+                    tar, tmp_dir, name, mtime,
+                    lambda outfile: write_log_lines(outfile, rng, layout, encoding, period_start, period_end,
+                                                    file_budget // generations),
+                    compress=generation > 0)
+                members.append((name, written, size))
+                if verbose:
+                    print(f"{written / (1024 * 1024):10.1f} MB  {name}")
+        for path, kind, size in JUNK_FILES:
+            mtime = time.mktime(end_time.timetuple())
+            written, stored = add_member(tar, tmp_dir, path, mtime, lambda outfile: write_junk(outfile, rng, kind, size))
+            members.append((path, written, stored))
+    return members
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic tech-support .tar.gz bundle.')
+    parser.add_argument('--output', required=True, help='Path of the .tar.gz to write')
+    parser.add_argument('--size_mb', type=int, default=100, help='Approximate uncompressed size of the logs in MB')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed, the same seed gives the same bundle')
+    parser.add_argument('--start', default="2024-05-05 00:00:00", help='First timestamp (YYYY-MM-DD HH:MM:SS)')
+    parser.add_argument('--hours', type=int, default=168, help='Time span covered by the logs')
+    args = parser.parse_args()
+
+    if not args.output.endswith(".tar.gz"):
+        sys.exit("--output must end with .tar.gz (techTool.py only accepts .tar.gz bundles)")
+    started = time.perf_counter()
+    members = generate_bundle(args.output, args.size_mb, args.seed, args.start, args.hours)
+    total = sum(written for _, written, _ in members)
+    print(f"\n{len(members)} files, {total / (1024 * 1024):.1f} MB of logs, "
+          f"{os.path.getsize(args.output) / (1024 * 1024):.1f} MB bundle written to {args.output} "
+          f"in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,45 @@ import tarfile
 import shutil
 import time
 import datetime
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 #from datetime import datetime, timedelta
 import subprocess
 from pathlib import Path
-import chardet
+try:
+    import chardet
+except ImportError:     # Only needed for files that are neither BOM-marked nor UTF-8
+    chardet = None
 import re
 import tempfile
 import base64
 import logging
 import gzip
+import hashlib
+import json
+import bz2
+import codecs
+import lzma
 import argparse
+import array
+import asyncio
+import bisect
+import concurrent.futures
+import contextlib
+import cProfile
+import heapq
+import itertools
+import io
+import mmap
+import operator
+import sys
+try:
+    import resource
+except ImportError:     # Not available on Windows, --profile then reports no peak RSS
+    resource = None
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:     # Python < 3.9, --tz_rule then only takes UTC and fixed offsets
+    ZoneInfo = None
 
 
 
@@ -36,6 +64,64 @@ def extract_tar_to_folder(tar_path: str, output_dir: str):
     except Exception as e:
         print(f"Error extracting tar file: {e}")
 
+def iter_tar_log_members(tar, output_path, expand_tree, external_list_of_files, min_list_of_files, log_mode, start_date):
+    """
+    Walks the tar members once and yields (path, member) for the log files to process.
+    path is where the member would have been extracted under output_path, the same
+    size / external list / min list / modification time filters as the extracted mode apply to it.
+    """
+    start_datetime = datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S")
+    tree = os.path.join(os.path.abspath(expand_tree), '')
+    exclude = compile_path_patterns(external_list_of_files)
+    include = compile_path_patterns(min_list_of_files) if log_mode == "min" else None
+    for member in tar:
+        if not member.isfile():
+            continue
+        path = os.path.join(output_path, member.name)
+        if not os.path.abspath(path).startswith(tree):
+            continue
+        if member.size < MIN_LOG_FILE_SIZE:
+            continue
+        if exclude is not None and exclude.search(path):
+            continue
+        if include is not None and not include.search(path):
+            continue
+        if datetime.fromtimestamp(member.mtime) <= start_datetime:
+            continue
+        yield path, member
+
+def process_tar_members(tar_path, output_path, expand_tree, change_hour, external_list_of_files, min_list_of_files,
+                        log_mode, start_date, end_date, cache_dir=None, columnar=False, member_root=None):
+    """
+    Archive mode: streams the selected log files straight out of the tar file into process_log_file(),
+    nothing is extracted to disk. Lines outside start_date - end_date are dropped while parsing.
+    member_root is where the bundle would be extracted (output_path/<node id> with several bundles).
+
+    Returns:
+        list: Paths (as if extracted under member_root, output_path by default) of the processed members.
+    """
+    processed = []
+    window = (start_date, end_date)
+    try:
+        with tarfile.open(tar_path, 'r|*') as tar:
+            for path, member in iter_tar_log_members(tar, member_root or output_path, expand_tree,
+                                                     external_list_of_files, min_list_of_files, log_mode, start_date):
+                print(f"Working on {path}\n")
+                member_file = tar.extractfile(member)
+                if member_file is None:
+                    continue
+                with member_file:
+                    if cache_dir is None:
+                        process_log_file(path, change_hour, output_path, fileobj=member_file, window=window,
+                                         size=member.size, columnar=columnar, mtime=member.mtime)
+                    else:
+                        process_log_file_cached(path, change_hour, output_path, cache_dir, member.name,
+                                                member.size, member.mtime, fileobj=member_file, window=window)
+                processed.append(path)
+    except (tarfile.TarError, OSError) as e:
+        print(f"Error reading tar file: {e}")
+    return processed
+
 def remove_directory(expand_tree: str):
     """
     Removes a directory and its contents (files and subdirectories).
@@ -76,33 +162,75 @@ def print_file_content(file_name):
 
 
 
-def read_log_file(file_name):
-    """Reads the log file and returns its lines."""
-    encodings = ['utf-8', 'latin-1', 'iso-8859-1']
-    
-    for encoding in encodings:
-        try:
-            with open(file_name, 'r', encoding=encoding) as log_file:
-                return log_file.readlines()
-        except UnicodeDecodeError:
-            logging.warning(f"Failed to decode '{file_name}' with encoding '{encoding}'. Trying next encoding.")
-        except FileNotFoundError:
-            logging.error(f"File '{file_name}' not found.")
-            return []
-        except Exception as e:
-            logging.error(f"An error occurred while reading '{file_name}' with encoding '{encoding}': {e}")
-            return []
+# Compressed logs are decompressed on the fly, no intermediate file is written
+READ_BUFFER_SIZE = 1024 * 1024
+COMPRESSED_LOG_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
 
-    # If all encoding attempts fail, read the file in binary mode
+def log_base_name(file_name):
+    """Base name of a log file without its compression suffix ('messages.1.gz' -> 'messages.1')."""
+    base_name = os.path.basename(file_name)
+    root, extension = os.path.splitext(base_name)
+    if extension in COMPRESSED_LOG_OPENERS:
+        return root
+    return base_name
+
+def open_log_binary(file_name, fileobj=None):
+    """
+    Opens the raw bytes of a log, decompressing .gz/.bz2/.xz files on the fly.
+    When fileobj is given (e.g. a tar member) it is read instead of file_name.
+    Reads go through a READ_BUFFER_SIZE buffer so memory per file stays constant.
+    """
+    opener = COMPRESSED_LOG_OPENERS.get(os.path.splitext(file_name)[1])
+    if opener is None:
+        return fileobj if fileobj is not None else open(file_name, 'rb', buffering=READ_BUFFER_SIZE)
+    return io.BufferedReader(opener(fileobj if fileobj is not None else file_name, 'rb'), buffer_size=READ_BUFFER_SIZE)
+
+def decode_log_line(raw_line):
+    """Decodes one line as UTF-8, falling back to latin-1 (which decodes any byte) for that line only."""
     try:
-        with open(file_name, 'rb') as log_file:
-            return log_file.readlines()
+        return raw_line.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw_line.decode('latin-1')
+
+def decode_raw_lines(raw_lines):
+    """
+    Yields the decoded lines of raw ('\n' terminated) byte lines.
+    Lines are split like text mode does ('\n', '\r\n' and '\r') and decoded one by one,
+    so a single undecodable line never forces a re-read of the whole file.
+    """
+    for raw_line in raw_lines:
+        if b'\r' in raw_line:
+            for part in raw_line.replace(b'\r\n', b'\n').split(b'\r'):
+                if part:
+                    yield decode_log_line(part)
+        else:
+            yield decode_log_line(raw_line)
+
+def iter_log_file(file_name, fileobj=None, byte_range=None):
+    """
+    Yields the lines of a log file, streamed in constant memory (see decode_raw_lines()).
+    Uncompressed files on disk are scanned through mmap and only the lines that may start
+    with a timestamp are yielded (every line with --multiline, see iter_mapped_log_file()), optionally
+    only those in byte_range.
+    """
+    try:
+        if fileobj is None and os.path.splitext(file_name)[1] not in COMPRESSED_LOG_OPENERS:
+            yield from iter_mapped_log_file(file_name, byte_range)
+            return
+        with open_log_binary(file_name, fileobj) as log_file:
+            yield from decode_raw_lines(log_file)
     except FileNotFoundError:
         logging.error(f"File '{file_name}' not found.")
-        return []
     except Exception as e:
-        logging.error(f"An error occurred while reading '{file_name}' in binary mode: {e}")
-        return []
+        logging.error(f"An error occurred while reading '{file_name}': {e}")
+
+def read_log_file(file_name, fileobj=None):
+    """Reads the log file and returns its lines. When fileobj is given the lines are read from it."""
+    return list(iter_log_file(file_name, fileobj))
 
 
 
@@ -153,71 +281,619 @@ def parse_timestamp(line, TIMESTAMP_FORMATS):
     # If no format matches, return None for both timestamp and message
     return None, None
 
+
+# Fast fixed-offset timestamp parsers, one per TIMESTAMP_FORMATS entry.
+# They return (year, month, day, hour, minute, second, microsecond) and raise ValueError
+# on the same inputs datetime.strptime() rejects, except Feb 29 without a year (see YEARLESS_YEAR).
+MONTH_NUMBERS = {name: number for number, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), start=1)}
+WEEKDAY_NAMES = frozenset(('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'))
+DAYS_IN_MONTH = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+YEARLESS_YEAR = 1904    # Placeholder year of formats without one, a leap year so that Feb 29 parses
+
+def is_leap_year(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+def check_timestamp_fields(fields):
+    """Raises ValueError when the fields are not a valid date and time."""
+    year, month, day, hour, minute, second, microsecond = fields
+    if not 1 <= month <= 12:
+        raise ValueError(f"month {month} is out of range")
+    days = 29 if month == 2 and is_leap_year(year) else DAYS_IN_MONTH[month]
+    if year < 1 or not 1 <= day <= days:
+        raise ValueError(f"day is out of range for month: {year}-{month}-{day}")
+    if hour > 23 or minute > 59 or second > 59:
+        raise ValueError(f"time {hour}:{minute}:{second} is out of range")
+    return fields
+
+def month_number(name):
+    try:
+        return MONTH_NUMBERS[name.lower()]
+    except KeyError:
+        raise ValueError(f"unknown month name '{name}'")
+
+def parse_fraction(digits):
+    """%f semantics: 1 to 6 digits, padded on the right."""
+    if not 0 < len(digits) <= 6:
+        raise ValueError(f"invalid fraction '{digits}'")
+    return int(digits.ljust(6, '0'))
+
+def parse_fixed_datetime(value):
+    # YYYY-MM-DD HH:MM:SS (any separators, seconds may have a single digit)
+    return check_timestamp_fields((int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                                   int(value[11:13]), int(value[14:16]), int(value[17:]), 0))
+
+def parse_fixed_datetime_fraction(value):
+    # YYYY-MM-DD HH:MM:SS.ffffff (any separators)
+    return check_timestamp_fields((int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                                   int(value[11:13]), int(value[14:16]), int(value[17:19]), parse_fraction(value[20:])))
+
+def parse_day_month_year(value):
+    # D-Mon-YYYY
+    day, month, year = value.split('-')
+    return check_timestamp_fields((int(year), month_number(month), int(day), 0, 0, 0, 0))
+
+def parse_day_month_year_time(value):
+    # D-Mon-YYYY::HH:MM:SS.fff
+    date_part, time_part = value.split('::')
+    day, month, year = date_part.split('-')
+    return check_timestamp_fields((int(year), month_number(month), int(day),
+                                   int(time_part[0:2]), int(time_part[3:5]), int(time_part[6:8]), parse_fraction(time_part[9:])))
+
+def parse_weekday_month_day_time_year(value):
+    # Www Mon D HH:MM:SS YYYY - the weekday name is checked but not matched against the date, as strptime does
+    weekday, month, day, time_part, year = value.split()
+    if weekday.lower() not in WEEKDAY_NAMES:
+        raise ValueError(f"unknown weekday name '{weekday}'")
+    return check_timestamp_fields((int(year), month_number(month), int(day),
+                                   int(time_part[0:2]), int(time_part[3:5]), int(time_part[6:8]), 0))
+
+def parse_month_day_time(value):
+    # Mon D HH:MM:SS - no year: YEARLESS_YEAR until infer_year() gives the line its year
+    month, day, time_part = value.split()
+    return check_timestamp_fields((YEARLESS_YEAR, month_number(month), int(day),
+                                   int(time_part[0:2]), int(time_part[3:5]), int(time_part[6:8]), 0))
+
+def parse_unsupported(value):
+    # strptime cannot compile a format with two %f directives
+    raise ValueError(f"unsupported timestamp '{value}'")
+
+FAST_PARSERS_BY_FORMAT = {
+    "%Y-%m-%d %H:%M:%S,%f": parse_fixed_datetime_fraction,
+    "%Y-%m-%dT%H:%M:%S.%f": parse_fixed_datetime_fraction,
+    "%Y-%m-%d %H:%M:%S.%f": parse_fixed_datetime_fraction,
+    "%Y-%m-%dT%H:%M:%S": parse_fixed_datetime,
+    "%Y/%m/%d %H:%M:%S": parse_fixed_datetime,
+    "%Y-%m-%d %H:%M:%S": parse_fixed_datetime,
+    "%d-%b-%Y": parse_day_month_year,
+    "%d-%b-%Y::%H:%M:%S.%f": parse_day_month_year_time,
+    "%a %b %d %H:%M:%S %Y": parse_weekday_month_day_time_year,
+    "%b %d %H:%M:%S": parse_month_day_time,
+    "%Y-%m-%d %H:%M:%S,%f.%f": parse_unsupported,
+}
+
+TIMESTAMP_FORMAT_LIST = list(TIMESTAMP_FORMATS.items())
+FAST_TIMESTAMP_PARSERS = [FAST_PARSERS_BY_FORMAT[datetime_format] for _, datetime_format in TIMESTAMP_FORMAT_LIST]
+
+def days_from_civil(year, month, day):
+    """Number of days from 1970-01-01 to a proleptic Gregorian date."""
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+def format_timestamp(fields):
+    """Canonical '%Y-%m-%d %H:%M:%S.%f' string of timestamp fields."""
+    year, month, day, hour, minute, second, microsecond = fields
+    return f"{year:04d}-{month:02d}-{day:02d} {hour:02d}:{minute:02d}:{second:02d}.{microsecond:06d}"
+
+def civil_from_days(days):
+    """Proleptic Gregorian (year, month, day) of a number of days from 1970-01-01 (inverse of days_from_civil())."""
+    days += 719468
+    era = days // 146097
+    day_of_era = days - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    month_index = (5 * day_of_year + 2) // 153
+    day = day_of_year - (153 * month_index + 2) // 5 + 1
+    month = month_index + 3 if month_index < 10 else month_index - 9
+    return year_of_era + era * 400 + (month <= 2), month, day
+
+def timestamp_key(fields):
+    """Integer epoch-microsecond sort key of timestamp fields."""
+    year, month, day, hour, minute, second, microsecond = fields
+    return ((days_from_civil(year, month, day) * 86400 + hour * 3600 + minute * 60 + second) * 1000000
+            + microsecond)
+
+def parse_timestamp_fast(line):
+    """
+    parse_timestamp() on TIMESTAMP_FORMATS with the fast parsers.
+    Returns (index of the matching entry, timestamp fields, message).
+    """
+    for index, (pattern, _) in enumerate(TIMESTAMP_FORMAT_LIST):
+        match = pattern.match(line)
+        if match:
+            try:
+                fields = FAST_TIMESTAMP_PARSERS[index](match.group(1))
+            except ValueError:
+                continue
+            return index, fields, line[match.end():].strip()
+    return None, None, None
+
+
+# Per-file timestamp format detection
+FORMAT_SAMPLE_LINES = 50        # Lines parsed against the full list before a format is pinned
+
+# One alternation of all the entries listed before each format. When it does not match a line,
+# no earlier entry can take precedence and the pinned format alone gives the parse_timestamp() result.
+TIMESTAMP_GUARDS = [
+    re.compile("|".join(f"(?:{pattern.pattern})" for pattern, _ in TIMESTAMP_FORMAT_LIST[:index])) if index else None
+    for index in range(len(TIMESTAMP_FORMAT_LIST))
+]
+
+def new_format_detector(sample_lines=FORMAT_SAMPLE_LINES):
+    """
+    Creates the per-file detector state used by parse_timestamp_detected().
+    The first sample_lines lines vote for the entry that parsed them, the winner is then pinned.
+    """
+    return {
+        'sample_lines': sample_lines,
+        'sampled': 0,
+        'votes': [0] * len(TIMESTAMP_FORMAT_LIST),
+        'pinned': None,
+        'hits': 0,
+        'misses': 0,
+        'fallbacks': [0] * len(TIMESTAMP_FORMAT_LIST),     # Entries that parsed the misses
+    }
+
+def parse_timestamp_detected(line, detector):
+    """
+    parse_timestamp_fast() with a pinned per-file format, returns (timestamp fields, message).
+    Once a format is pinned a line costs one guard check and one match; on a miss the full list is used.
+    """
+    pinned = detector['pinned']
+    if pinned is not None:
+        guard = TIMESTAMP_GUARDS[pinned]
+        if guard is None or not guard.match(line):
+            match = TIMESTAMP_FORMAT_LIST[pinned][0].match(line)
+            if match:
+                try:
+                    fields = FAST_TIMESTAMP_PARSERS[pinned](match.group(1))
+                    detector['hits'] += 1
+                    return fields, line[match.end():].strip()
+                except ValueError:
+                    pass
+        detector['misses'] += 1
+        index, fields, message = parse_timestamp_fast(line)
+        if index is not None:
+            detector['fallbacks'][index] += 1
+        return fields, message
+
+    index, fields, message = parse_timestamp_fast(line)
+    detector['sampled'] += 1
+    if index is not None:
+        detector['votes'][index] += 1
+    if detector['sampled'] >= detector['sample_lines'] and any(detector['votes']):
+        votes = detector['votes']
+        detector['pinned'] = votes.index(max(votes))
+    return fields, message
+
+# Memory-mapped scanning of uncompressed files. A bytes regex finds the lines that may start with
+# a timestamp; the lines in between are only checked to be plain ASCII without '\r'. On such bytes
+# the str patterns behave like bytes ones, so no TIMESTAMP_FORMATS entry can match them and they
+# are skipped without being decoded. Anything else goes through the normal decoding.
+STRIPPED_ASCII = rb"[ \t\x0b\x0c\x1c-\x1f]*"     # ASCII characters str.strip() removes ('\r' excluded)
+# The common beginnings of the TIMESTAMP_FORMATS patterns - it must match (at least) every line
+# one of the patterns matches, extend it when an entry with a new beginning is added.
+TIMESTAMP_PREFIXES = rb"(?:\d{4}[-/]\d\d[-/]\d\d[ T]|<(?:DEBUG|INFO)> \d|\|\d{4}-|\w{3} (?:\w{3} )? ?\d)"
+TIMESTAMP_LINE_START = re.compile(rb"\n" + STRIPPED_ASCII + TIMESTAMP_PREFIXES)
+OTHER_LINE_START = re.compile(rb"\n(?!" + STRIPPED_ASCII + TIMESTAMP_PREFIXES + rb")")
+
+def iter_mapped_lines(mapped, start, end, skip_plain_ascii=False):
+    """
+    Yields the decoded lines of mapped[start:end], read in slices of about READ_BUFFER_SIZE.
+    With skip_plain_ascii, slices that are plain ASCII without '\r' are skipped.
+    """
+    while start < end:
+        stop = min(end, start + READ_BUFFER_SIZE)
+        if stop < end:
+            newline = mapped.rfind(b'\n', start, stop)
+            if newline < 0:
+                newline = mapped.find(b'\n', stop, end)
+            stop = end if newline < 0 else newline + 1
+        region = mapped[start:stop]
+        if not skip_plain_ascii or not region.isascii() or b'\r' in region:
+            yield from decode_raw_lines(io.BytesIO(region))
+        start = stop
+
+def iter_mapped_log_file(file_name, byte_range=None):
+    """
+    iter_log_file() for an uncompressed file through mmap: yields the decoded lines that
+    may start with a timestamp, plus every line the bytes regex cannot rule out.
+    normalize_line() gives the same result as on all the lines of the file. With --multiline every
+    line is yielded, the lines without a timestamp are part of the records.
+    The file alternates between blocks of timestamp lines and blocks of other lines,
+    each block boundary costs one regex search - not every line.
+    byte_range optionally is the (start, end) of the lines to read, start at a line start.
+    """
+    with open(file_name, 'rb') as log_file:
+        if os.fstat(log_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            block_start, size = byte_range if byte_range is not None else (0, len(mapped))
+            # The first line is always decoded
+            while block_start < size:
+                match = OTHER_LINE_START.search(mapped, block_start, size)
+                block_end = match.start() + 1 if match else size
+                yield from iter_mapped_lines(mapped, block_start, block_end)
+                match = TIMESTAMP_LINE_START.search(mapped, block_end - 1, size) if match else None
+                block_start = match.start() + 1 if match else size
+                # The other lines are continuations of the records before them with --multiline
+                yield from iter_mapped_lines(mapped, block_end, block_start, skip_plain_ascii=not MULTILINE)
+
 def remove_semicolons(message):
     return message.replace(";", "")
 
-def process_lines(lines, change_hour, file_name):
-    """Processes the log lines and adjusts timestamps as needed."""
-    last_timestamp = None
-    processed_lines = []
-    
-    current_year = datetime.now().year
+# Nodes (several --tar_file bundles): every bundle is extracted under output_path/<node id> and its
+# lines carry the node id in front of the file name column. Each node can get a clock offset
+# (--node_offset) that is added to its timestamps like --change_hour.
+NODES = []      # (root directory with a trailing separator, padded node id, offset in microseconds)
+
+def set_nodes(nodes):
+    """Installs the (root directory, node id, offset seconds) of every bundle, [] for a single bundle."""
+    global NODES
+    width = max((len(node) for _, node, _ in nodes or []), default=0)
+    NODES = [(os.path.join(os.path.abspath(root), ''), node.ljust(width), round(offset * 1000000))
+             for root, node, offset in nodes or []]
+
+def node_of(file_name):
+    """(padded node id, offset in microseconds) of the bundle file_name belongs to, (None, 0) without nodes."""
+    if NODES:
+        path = os.path.abspath(file_name)
+        for root, node, offset in NODES:
+            if path.startswith(root):
+                return node, offset
+    return None, 0
+
+def wip_file_path(output_path, file_name):
+    """The WIP file of a log file: WIP/<base name>, WIP/<node id>/<base name> with several bundles."""
+    node, _ = node_of(file_name)
+    if node is None:
+        return os.path.join(output_path, "WIP", log_base_name(file_name))
+    return os.path.join(output_path, "WIP", node.rstrip(), log_base_name(file_name))
+
+# Multiline records (--multiline): the lines without a timestamp (stack traces, continuation lines,
+# multi-line dumps) are attached to the timestamped line before them. A record is written as its first
+# line followed by '\t' prefixed continuation lines, and is sorted, merged, trimmed and indexed as one
+# unit: the consumers of the normalized files group a line with the '\t' lines after it.
+MULTILINE = 0       # Max characters of a record's continuation lines, 0 when --multiline is off
+MULTILINE_MAX_KB = 1024     # Default --multiline_max_kb
+
+def set_multiline(max_chars):
+    global MULTILINE
+    MULTILINE = max_chars
+
+# Time zone rules (--tz_rule PATTERN=ZONE): the timestamps of the files matching PATTERN (a path
+# substring or glob, as in external_list_of_files) are in ZONE and are converted to UTC, the first
+# matching rule wins. --change_hour then shifts every file by whole hours. The offsets are integer
+# microseconds added to the timestamp key in normalize_record(), the offset of a zone with DST is
+# looked up once per hour of the file.
+TIME_ZONE_RULES = []    # (rule, compiled pattern, tzinfo)
+
+def parse_time_zone(name):
+    """tzinfo of 'UTC', a fixed offset ('+02:00', '-0530', '+3') or an IANA zone name ('Asia/Jerusalem')."""
+    if name.upper() in ('UTC', 'Z'):
+        return timezone.utc
+    match = re.fullmatch(r"([+-])(\d\d?)(?::?(\d\d))?", name)
+    if match:
+        sign, hours, minutes = match.groups()
+        offset = timedelta(hours=int(hours), minutes=int(minutes or 0))
+        return timezone(-offset if sign == '-' else offset)
+    if ZoneInfo is None:
+        raise ValueError(f"time zone '{name}' needs the zoneinfo module (Python 3.9+)")
+    try:
+        return ZoneInfo(name)
+    except (ValueError, KeyError, OSError) as e:     # ZoneInfoNotFoundError is a KeyError
+        raise ValueError(f"unknown time zone '{name}'") from e
+
+def parse_time_zone_rule(rule):
+    """Splits 'PATTERN=ZONE' into (compiled pattern, tzinfo)."""
+    pattern, separator, name = rule.rpartition('=')
+    if not separator or not pattern:
+        raise ValueError(f"'{rule}' is not PATTERN=ZONE")
+    source = glob_to_regex(pattern) if GLOB_CHARACTERS.search(pattern) else re.escape(pattern)
+    return re.compile(source), parse_time_zone(name)
+
+def set_time_zone_rules(rules):
+    """Installs the --tz_rule strings, in order (the --jobs workers get the same list)."""
+    global TIME_ZONE_RULES
+    TIME_ZONE_RULES = [(rule,) + parse_time_zone_rule(rule) for rule in rules or []]
+
+def time_zone_rule(file_name):
+    """The first --tz_rule matching file_name as (rule, tzinfo), (None, None) when no rule matches."""
+    for rule, pattern, zone in TIME_ZONE_RULES:
+        if pattern.search(file_name):
+            return rule, zone
+    return None, None
 
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue  # Skip empty lines
+def fields_from_key(key):
+    """Timestamp fields of an epoch-microsecond key (the inverse of timestamp_key())."""
+    second, microsecond = divmod(key, 1000000)
+    days, second = divmod(second, 86400)
+    hour, second = divmod(second, 3600)
+    minute, second = divmod(second, 60)
+    return civil_from_days(days) + (hour, minute, second, microsecond)
 
-        timestamp, message = parse_timestamp(line , TIMESTAMP_FORMATS)
-        if timestamp is None:
-            continue
+def time_shift(file_name, change_hour):
+    """
+    Returns a function moving the timestamp fields of file_name to the output timeline - its
+    --tz_rule zone converted to UTC, then change_hour hours and the node's clock offset added - or None
+    when they stay as they are.
+    """
+    offset = int(change_hour) * 3600000000 + node_of(file_name)[1]
+    _, zone = time_zone_rule(file_name)
+    if zone is None:
+        if not offset:
+            return None
+        return lambda fields: fields_from_key(timestamp_key(fields) + offset)
+
+    hour_offsets = {}
+
+    def shift(fields):
+        key = timestamp_key(fields)
+        hour = key // 3600000000
+        hour_offset = hour_offsets.get(hour)
+        if hour_offset is None:
+            utc_offset = datetime(*fields[:4], tzinfo=zone).utcoffset()
+            hour_offset = hour_offsets[hour] = offset - utc_offset // timedelta(microseconds=1)
+        return fields_from_key(key + hour_offset)
+
+    return shift
+
+def new_line_context(file_name, change_hour, window=None, mtime=None):
+    """
+    Per-file state of normalize_line(). window is an optional (start, end) pair of
+    'YYYY-mm-dd HH:MM:SS' strings, lines outside it are dropped and counted in 'dropped'.
+    mtime is the modification time of the file (tar members); the file on disk is stat'ed when it is None.
+    """
+    base_name = log_base_name(file_name)
+    if len(base_name) < 32:
+         file_base = base_name.ljust(32, ' ')
+    else:
+        file_base = base_name[:32]
+    node, _ = node_of(file_name)
+    if node is not None:
+        file_base = f"{node} {file_base}"
+    return {
+        'file_name': file_name,
+        'change_hour': change_hour,
+        'shift': time_shift(file_name, change_hour),
+        'file_base': file_base,
+        'year_anchor': year_anchor(file_name, mtime),
+        'last_fields': None,
+        'detector': new_format_detector(),
+        'window': window,
+        'window_fields': window_fields(window),
+        'dropped': 0,
+        'multiline': MULTILINE,
+    }
+
+YEAR_ANCHOR_SLACK = 86400      # Seconds a line may be after its file's mtime (timezones, clock skew)
+
+def year_anchor(file_name, mtime=None):
+    """
+    Timestamp fields of the latest moment a line of the file can have: its mtime (now when the
+    file has none) plus YEAR_ANCHOR_SLACK. Year-less lines get the year that puts them before it.
+    """
+    if mtime is None:
+        try:
+            mtime = os.path.getmtime(file_name)
+        except OSError:
+            mtime = time.time()
+    moment = datetime.fromtimestamp(mtime + YEAR_ANCHOR_SLACK)
+    return (moment.year, moment.month, moment.day, moment.hour, moment.minute, moment.second, moment.microsecond)
 
-        timestamp_tmp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f")
-        year = timestamp_tmp.year        
-        if year < 2000:
-            # Construct a new datetime object with the current year
-            updated_timestamp = timestamp_tmp.replace(year=current_year)
-            # Convert the updated timestamp back to string format
-            timestamp = updated_timestamp.strftime("%Y-%m-%d %H:%M:%S.%f") +'*'
-
-        base_name = os.path.basename(file_name)
-        if len(base_name) < 32:
-             file_base = base_name.ljust(32, ' ')
-        else:
-            file_base = base_name[:32]
+def infer_year(fields, context):
+    """
+    Gives year-less timestamp fields (year YEARLESS_YEAR) a year. The first one of a file without full timestamps
+    before it is anchored on year_anchor(); later ones take the year of the previous timestamp of the file,
+    plus one when the month drops by more than six (December -> January) or minus one when it jumps
+    by more than six (a late line of the previous year). Raises ValueError for Feb 29 when the inferred
+    year is not a leap year.
+    """
+    last_fields = context['last_fields']
+    if last_fields is None:
+        anchor = context['year_anchor']
+        year = anchor[0] if fields[1:] <= anchor[1:] else anchor[0] - 1
+    else:
+        year = last_fields[0]
+        if fields[1] < last_fields[1] - 6:
+            year += 1
+        elif fields[1] > last_fields[1] + 6:
+            year -= 1
+    return check_timestamp_fields((year,) + fields[1:])
+
+def window_fields(window):
+    """(start, end) window strings as (year, month, day, hour, minute, second) tuples, which compare the same way."""
+    if window is None:
+        return None
+    return tuple(tuple(int(value) for value in re.split(r"[- :]", bound)) for bound in window)
+
+NO_TIMESTAMP = ()   # normalize_record() of an empty line or a line without a timestamp
+
+def normalize_record(line, context):
+    """
+    Parses one log line into (timestamp fields, year marker, message), the parts of its normalized form.
+    The year marker is '*' when the line had no year and it was inferred by infer_year(), '' otherwise.
+    Returns NO_TIMESTAMP when the line is empty or has no timestamp, None when it is dropped
+    (out of the window or an invalid date); both are false.
+    """
+    line = line.strip()
+    if not line:
+        return NO_TIMESTAMP  # Skip empty lines
 
-        clean_message = remove_semicolons(message)
+    fields, message = parse_timestamp_detected(line, context['detector'])
+    if fields is None:
+        return NO_TIMESTAMP
 
-        processed_lines.append(f"{timestamp}  {file_base} {clean_message}\n")
+    marker = ''
+    if fields[0] < 2000:
+        # No year in the line - infer it from the file's previous timestamps or its mtime
+        try:
+            fields = infer_year(fields, context)
+        except ValueError:
+            return None  # Feb 29 moved to a non leap year
+        marker = '*'
+    context['last_fields'] = fields
+
+    shift = context['shift']
+    if shift is not None:
+        fields = shift(fields)
+
+    window = context['window_fields']
+    if window is not None and not window[0] <= fields[:6] <= window[1]:
+        context['dropped'] += 1
+        return None
+
+    return fields, marker, remove_semicolons(message)
+
+def render_record(record, context):
+    """The normalized text line of a normalize_record() tuple."""
+    fields, marker, clean_message = record
+    return f"{format_timestamp(fields)}{marker}  {context['file_base']} {clean_message}\n"
+
+def normalize_line(line, context):
+    """Returns the normalized form of one log line, or None when the line has no timestamp or is out of the window."""
+    record = normalize_record(line, context)
+    if not record:
+        return None
+    return render_record(record, context)
+
+def assemble_records(lines, context):
+    """
+    normalize_record() for --multiline: yields one (fields, marker, message) tuple per timestamped
+    line, its message followed by the lines without a timestamp after it, each as '\n\t' + line
+    (semicolons removed, like in the message).
+    The parts of a record are kept in a list and joined once, and only context['multiline']
+    characters of continuation lines are kept per record - the rest are counted in a marker line.
+    Continuation lines of a dropped record (out of the window) are dropped with it.
+    """
+    limit = context['multiline']
+    record = parts = None
+    size = truncated = 0
+    for line in lines:
+        result = normalize_record(line, context)
+        if result is NO_TIMESTAMP:
+            if parts is not None:
+                continuation = remove_semicolons(line.rstrip())
+                if not continuation:
+                    continue
+                size += len(continuation) + 2
+                if size <= limit:
+                    parts.append(continuation)
+                else:
+                    truncated += 1
+            continue
+        if record is not None:
+            if truncated:
+                parts.append(f"[{truncated} more lines truncated]")
+            yield record[0], record[1], '\n\t'.join(parts)
+        record = result
+        parts = [result[2]] if result is not None else None
+        size = truncated = 0
+    if record is not None:
+        if truncated:
+            parts.append(f"[{truncated} more lines truncated]")
+        yield record[0], record[1], '\n\t'.join(parts)
+
+def log_line_context(context):
+    detector = context['detector']
+    if detector['pinned'] is not None:
+        logging.debug(f"'{context['file_name']}': pinned timestamp format {detector['pinned']} "
+                      f"({detector['hits']} hits, {detector['misses']} misses)")
+
+def process_lines(lines, change_hour, file_name, window=None, context=None):
+    """
+    Processes the log lines and adjusts timestamps as needed. Yields the normalized lines.
+    context optionally supplies the new_line_context() so the caller can inspect it afterwards.
+    """
+    if context is None:
+        context = new_line_context(file_name, change_hour, window)
+
+    if context['multiline']:
+        for record in assemble_records(lines, context):
+            yield render_record(record, context)
+    else:
+        for line in lines:
+            processed_line = normalize_line(line, context)
+            if processed_line is not None:
+                yield processed_line
     #break here
-    return processed_lines
+    log_line_context(context)
 
-def save_processed_lines(processed_lines, output_path, file_name):
-    """Saves the processed lines to the output directory."""
+def process_records(lines, context):
+    """process_lines() for the columnar intermediate: yields normalize_record() tuples."""
+    if context['multiline']:
+        yield from assemble_records(lines, context)
+    else:
+        for line in lines:
+            record = normalize_record(line, context)
+            if record:
+                yield record
+    log_line_context(context)
 
-    if not processed_lines:
+WRITE_BATCH_LINES = 4096    # Lines handed to writelines() at once
+
+def save_processed_lines(processed_lines, output_path, file_name):
+    """
+    Saves the processed lines (any iterable, consumed in batches) to the output directory.
+    Returns the written file path.
+    """
+    processed_lines = iter(processed_lines)
+    first_batch = list(itertools.islice(processed_lines, WRITE_BATCH_LINES))
+    if not first_batch:
         logging.error(f"No processed lines to save for file '{file_name}'.")
         return
 
     try:
-        output_file_name = os.path.basename(file_name)
-        output_file_path = os.path.join(output_path, "WIP", output_file_name)
+        output_file_path = wip_file_path(output_path, file_name)
         os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-        with open(output_file_path, 'w', encoding='utf-8') as output_file:
+        with open(output_file_path, 'w', encoding='utf-8', buffering=READ_BUFFER_SIZE) as output_file:
             output_file.write('\ufeff')  # Write BOM for UTF-8
-            output_file.writelines(processed_lines)
+            batch = first_batch
+            while batch:
+                output_file.writelines(batch)
+                batch = list(itertools.islice(processed_lines, WRITE_BATCH_LINES))
         #logging.info(f"Processed lines are saved to {output_file_path}")
+        return output_file_path
     except Exception as e:
         logging.error(f"An error occurred while saving '{file_name}': {e}")
 
 
-def process_log_file(file_name, change_hour, output_path):
-    """Main function to process the log file."""
-    lines = read_log_file(file_name)
-    if not lines:
-        return
-    
-    processed_lines = process_lines(lines, change_hour, file_name)
+def process_log_file(file_name, change_hour, output_path, fileobj=None, window=None, size=None, columnar=False,
+                     mtime=None, byte_range=None):
+    """
+    Main function to process the log file. fileobj optionally supplies the content (archive mode).
+    Reading, parsing and writing are chained generators, so memory does not grow with the file.
+    Lines outside the optional (start, end) window are dropped right after the timestamp is parsed.
+    size is the input size reported by --profile for fileobj (the file size on disk otherwise).
+    columnar writes the WIP file in the columnar intermediate format instead of text lines.
+    mtime is the modification time of fileobj, the anchor of the year inference of year-less timestamps.
+    byte_range optionally limits an uncompressed file on disk to the lines in (start, end) (incremental mode).
+    """
+    lines = iter_log_file(file_name, fileobj, byte_range)
+    context = new_line_context(file_name, change_hour, window, mtime)
+    record = start_file_profile(file_name, size if fileobj is not None else None)
+    if record is not None:
+        lines = count_profile_items(lines, record, 'lines_in')
+    if columnar:
+        processed_lines = process_records(lines, context)
+    else:
+        processed_lines = process_lines(lines, change_hour, file_name, context=context)
+    if record is not None:
+        processed_lines = count_profile_items(processed_lines, record, 'lines_out')
     
     
     # Check if all lines start with specified years
@@ -225,7 +901,784 @@ def process_log_file(file_name, change_hour, output_path):
     #    logging.info("   File has timestamp from before 2020 / after 2135")
     #    processed_lines = fix_2000(lines)
     
-    save_processed_lines(processed_lines, output_path, file_name)
+    if columnar:
+        output_file_path = save_columnar_records(processed_lines, output_path, file_name, context['file_base'])
+    else:
+        output_file_path = save_processed_lines(processed_lines, output_path, file_name)
+    if output_file_path is None and context['dropped']:
+        # Without the window the file would have replaced a WIP file of the same name with lines
+        # the final trim drops - discard that WIP file so the trimmed output is unchanged
+        discard_wip_file(file_name, output_path)
+    end_file_profile(record, context, output_file_path)
+    return output_file_path
+
+def discard_wip_file(file_name, output_path):
+    """Removes the WIP file of file_name, if an earlier file of the same base name wrote one."""
+    try:
+        os.remove(wip_file_path(output_path, file_name))
+    except FileNotFoundError:
+        pass
+
+PEEK_BYTES = 64 * 1024      # Bytes read at the head / tail of a file to find its first / last timestamp
+
+def peek_timestamp_range(file_name, change_hour=0):
+    """
+    Returns the (lowest, highest) normalized timestamps ('YYYY-mm-dd HH:MM:SS') of the lines in the
+    first and last PEEK_BYTES of a log file. Compressed files cannot be read from the end, for them
+    only the head is sampled and highest is None. (None, None) when the head holds no timestamp.
+    """
+    def sample_timestamps(raw_lines):
+        # A context per sample: the year inference of the tail is anchored on the mtime, not on the head
+        context = new_line_context(file_name, change_hour)
+        for raw_line in raw_lines:
+            processed_line = normalize_line(decode_log_line(raw_line), context)
+            if processed_line is not None:
+                yield processed_line[:19]
+
+    with open_log_binary(file_name) as infile:
+        head = infile.read(PEEK_BYTES)
+    head_lines = head.split(b'\n')
+    if len(head) == PEEK_BYTES:
+        head_lines.pop()    # Partial last line
+    timestamps = list(sample_timestamps(head_lines))
+    if not timestamps:
+        return None, None
+    if os.path.splitext(file_name)[1] in COMPRESSED_LOG_OPENERS:
+        return min(timestamps), None
+
+    with open(file_name, 'rb') as infile:
+        file_size = infile.seek(0, os.SEEK_END)
+        if file_size > PEEK_BYTES:
+            infile.seek(max(PEEK_BYTES, file_size - PEEK_BYTES))
+            tail_lines = infile.read().split(b'\n')
+            tail_lines.pop(0)   # Partial first line
+            timestamps.extend(sample_timestamps(tail_lines))
+    return min(timestamps), max(timestamps)
+
+def outside_window(file_name, window, change_hour=0):
+    """
+    True when the head / tail sample shows the whole file is before or after the window.
+    Assumes the file is written in time order, like a log file is - an unordered file spreads
+    its sampled timestamps and is not skipped. For a compressed file only the head is sampled,
+    it is skipped when it starts after the window.
+    """
+    try:
+        lowest, highest = peek_timestamp_range(file_name, change_hour)
+    except (OSError, EOFError, lzma.LZMAError) as e:
+        logging.debug(f"Could not peek '{file_name}': {e}")
+        return False
+    if lowest is None:
+        return False
+    if highest is None:
+        return lowest > window[1]
+    return highest < window[0] or lowest > window[1]
+
+
+# Persistent cache of normalized per-file output, shared between runs.
+# An entry is keyed by the member path inside the bundle, its size, mtime and content hash
+# plus the settings that change the normalized lines.
+CACHE_VERSION = 4
+CACHE_MAX_MB = 2048
+
+def cache_settings(change_hour, file_name):
+    """Everything besides the file itself that changes the output of process_lines()."""
+    return (f"v{CACHE_VERSION}|change_hour={int(change_hour)}|tz_rule={time_zone_rule(file_name)[0]}"
+            f"|node={node_of(file_name)}|multiline={MULTILINE}")
+
+def content_hash(fileobj, copy_to=None):
+    """sha256 of a binary stream read in READ_BUFFER_SIZE chunks, optionally copying it to copy_to."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(READ_BUFFER_SIZE), b''):
+        digest.update(chunk)
+        if copy_to is not None:
+            copy_to.write(chunk)
+    return digest.hexdigest()
+
+def cache_key(member_path, size, mtime, digest, settings):
+    key_source = f"{os.path.normpath(member_path)}\0{size}\0{int(mtime)}\0{digest}\0{settings}"
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+def cache_entry_paths(cache_dir, key):
+    """Returns the (lines, meta) file paths of a cache entry."""
+    entry_dir = os.path.join(cache_dir, key[:2])
+    return os.path.join(entry_dir, key + '.log'), os.path.join(entry_dir, key + '.json')
+
+def cache_lookup(cache_dir, key):
+    """Returns the metadata of a cache entry, refreshing its LRU time, or None on a miss."""
+    lines_path, meta_path = cache_entry_paths(cache_dir, key)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+        if meta['lines']:
+            os.utime(lines_path)
+        os.utime(meta_path)
+        return meta
+    except (OSError, ValueError, KeyError):
+        return None
+
+def cache_store(cache_dir, key, processed_file, source):
+    """
+    Stores a normalized file (None when it produced no lines) together with its
+    line count and min/max timestamp. Files are written aside and renamed, so concurrent
+    workers never see a partial entry.
+    """
+    lines_path, meta_path = cache_entry_paths(cache_dir, key)
+    os.makedirs(os.path.dirname(lines_path), exist_ok=True)
+    meta = {'source': source, 'lines': 0, 'min_timestamp': None, 'max_timestamp': None}
+    try:
+        if processed_file is not None:
+            with open(processed_file, 'r', encoding='utf-8-sig') as infile, \
+                    open(lines_path + '.tmp', 'w', encoding='utf-8') as outfile:
+                outfile.write('\ufeff')
+                for line in iter_log_lines(infile):
+                    timestamp = log_sort_key(line).rstrip()
+                    if meta['lines'] == 0 or timestamp < meta['min_timestamp']:
+                        meta['min_timestamp'] = timestamp
+                    if meta['lines'] == 0 or timestamp > meta['max_timestamp']:
+                        meta['max_timestamp'] = timestamp
+                    meta['lines'] += 1
+                    outfile.write(line)
+            os.replace(lines_path + '.tmp', lines_path)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(meta_path + '.tmp', meta_path)
+    except OSError as e:
+        logging.warning(f"Could not cache '{source}': {e}")
+
+def evict_cache(cache_dir, max_bytes):
+    """Deletes the least recently used entries until the cache holds at most max_bytes."""
+    entries = {}
+    for entry_dir in os.scandir(cache_dir):
+        if not entry_dir.is_dir():
+            continue
+        for entry in os.scandir(entry_dir.path):
+            key, extension = os.path.splitext(entry.name)
+            if extension not in ('.log', '.json'):
+                continue
+            stat = entry.stat()
+            used, size, paths = entries.get(key, (0, 0, []))
+            entries[key] = (max(used, stat.st_mtime), size + stat.st_size, paths + [entry.path])
+
+    total = sum(size for _, size, _ in entries.values())
+    for used, size, paths in sorted(entries.values()):
+        if total <= max_bytes:
+            break
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+
+def copy_window_lines(source, output_file, window):
+    """
+    Copies the normalized lines (records) of source inside the (start, end) window to output_file,
+    which may be source itself. Returns output_file, or None when no line is in the window
+    (output_file is then removed, like process_log_file() does).
+    """
+    kept = 0
+    with open(source, 'r', encoding='utf-8-sig', newline='') as infile, \
+            open(output_file + '.tmp', 'w', encoding='utf-8', newline='', buffering=READ_BUFFER_SIZE) as outfile:
+        outfile.write('\ufeff')
+        for line in iter_log_lines(infile):
+            if window[0] <= line[:19] <= window[1]:
+                outfile.write(line)
+                kept += 1
+    if not kept:
+        os.remove(output_file + '.tmp')
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        return None
+    os.replace(output_file + '.tmp', output_file)
+    return output_file
+
+def process_log_file_cached(file_name, change_hour, output_path, cache_dir, member_path, size, mtime, fileobj=None,
+                            window=None):
+    """
+    process_log_file() through the cache: on a hit the cached lines are copied to WIP and
+    nothing is parsed. A tar member stream is spooled while it is hashed so it can be parsed on a miss.
+    Cache entries hold every line of the file, so they serve any window; the window is applied
+    when the lines are copied to WIP, whole entries are skipped by their min/max timestamp.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024) as spool:
+        if fileobj is not None:
+            digest = content_hash(fileobj, copy_to=spool)
+            spool.seek(0)
+        else:
+            with open(file_name, 'rb') as infile:
+                digest = content_hash(infile)
+        key = cache_key(member_path, size, mtime, digest, cache_settings(change_hour, file_name))
+
+        meta = cache_lookup(cache_dir, key)
+        if meta is not None:
+            logging.debug(f"Cache hit for '{member_path}'")
+            if not meta['lines']:
+                return None
+            output_file_path = wip_file_path(output_path, file_name)
+            os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+            lines_path = cache_entry_paths(cache_dir, key)[0]
+            if window is None or window[0] <= meta['min_timestamp'][:19] and meta['max_timestamp'][:19] <= window[1]:
+                shutil.copyfile(lines_path, output_file_path)
+                return output_file_path
+            if meta['max_timestamp'][:19] < window[0] or meta['min_timestamp'][:19] > window[1]:
+                discard_wip_file(file_name, output_path)
+                return None
+            return copy_window_lines(lines_path, output_file_path, window)
+
+        processed_file = process_log_file(file_name, change_hour, output_path,
+                                          fileobj=spool if fileobj is not None else None, size=size, mtime=mtime)
+        cache_store(cache_dir, key, processed_file, member_path)
+        if processed_file is not None and window is not None:
+            return copy_window_lines(processed_file, processed_file, window)
+        return processed_file
+
+def process_log_source(file_name, change_hour, output_path, cache_dir=None, window=None, columnar=False):
+    """
+    Processes an extracted log file, through the cache when cache_dir is set (text intermediate only).
+    With a window, a file whose head and tail are both outside it is skipped without being parsed.
+    """
+    if window is not None and outside_window(file_name, window, change_hour):
+        logging.info(f"Skipping '{file_name}': outside {window[0]} - {window[1]}")
+        discard_wip_file(file_name, output_path)
+        return None
+    if cache_dir is None:
+        return process_log_file(file_name, change_hour, output_path, window=window, columnar=columnar)
+    stat = os.stat(file_name)
+    return process_log_file_cached(file_name, change_hour, output_path, cache_dir,
+                                   os.path.relpath(file_name, output_path), stat.st_size, stat.st_mtime,
+                                   window=window)
+
+
+# Profiling (--profile): wall / CPU time, bytes, lines and peak RSS per pipeline stage and per parsed
+# file, plus how many lines each TIMESTAMP_FORMATS entry parsed. PROFILE stays None unless enabled,
+# every helper below is then a no-op.
+# The peak RSS of a stage or file is the process's VmHWM, reset through /proc/self/clear_refs when the
+# stage or file starts (Linux). Elsewhere only the process maximum so far (ru_maxrss) can be read: the
+# records then hold it at their start and end (max_rss_start_kb / max_rss_end_kb), a cumulative maximum.
+PROFILE = None
+PROFILE_TOP_FILES = 10
+PROFILE_REPORT = 'profile.json'
+PROC_STATUS = '/proc/self/status'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+
+def enable_profile():
+    global PROFILE
+    PROFILE = {'stages': [], 'files': [], 'format_hits': [0] * len(TIMESTAMP_FORMAT_LIST),
+               'rss_interval': reset_peak_rss(), 'rss_open': [], 'peak_rss_kb': None}
+
+def cpu_seconds():
+    """CPU time of this process plus its finished child processes (the --jobs workers)."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+def peak_rss_kb():
+    """Peak resident set size of this process or of its largest finished child, in KiB."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak // 1024 if sys.platform == 'darwin' else peak     # macOS reports bytes
+
+def read_peak_rss_kb():
+    """VmHWM of this process in KiB, the peak RSS since it started or since reset_peak_rss()."""
+    try:
+        with open(PROC_STATUS, encoding='ascii') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def reset_peak_rss():
+    """Resets VmHWM to the current RSS. Returns False where that is not possible (not Linux, kernel < 4.0)."""
+    if read_peak_rss_kb() is None:
+        return False
+    try:
+        with open(PROC_CLEAR_REFS, 'w', encoding='ascii') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+def add_peak_rss(peak):
+    """Raises the peak RSS of every open stage and file record to peak."""
+    if peak is None:
+        return
+    # Resetting VmHWM also resets the ru_maxrss of this process, the overall peak is kept here
+    PROFILE['peak_rss_kb'] = max(PROFILE['peak_rss_kb'] or 0, peak)
+    for record in PROFILE['rss_open']:
+        if record['peak_rss_kb'] is None or record['peak_rss_kb'] < peak:
+            record['peak_rss_kb'] = peak
+
+def start_rss_profile(record):
+    """
+    Starts measuring the peak RSS of a stage or file record. Records may overlap (a stage and its files,
+    files parsed concurrently): the high-water mark is handed to all open records before it is reset.
+    """
+    record['peak_rss_kb'] = None
+    if not PROFILE['rss_interval']:
+        record['max_rss_start_kb'] = peak_rss_kb()
+        return
+    add_peak_rss(read_peak_rss_kb())
+    reset_peak_rss()
+    PROFILE['rss_open'].append(record)
+    add_peak_rss(read_peak_rss_kb())
+
+def end_rss_profile(record):
+    if not PROFILE['rss_interval']:
+        record['max_rss_end_kb'] = peak_rss_kb()
+        return
+    add_peak_rss(read_peak_rss_kb())
+    PROFILE['rss_open'].remove(record)
+
+def start_profile_stage(name, **counts):
+    """Starts timing a pipeline stage, counts are any of bytes_in / bytes_out / lines_in / lines_out."""
+    if PROFILE is None:
+        return None
+    record = {'stage': name, 'wall_s': None, 'cpu_s': None, 'bytes_in': None, 'bytes_out': None,
+              'lines_in': None, 'lines_out': None, 'peak_rss_kb': None}
+    record.update(counts)
+    start_rss_profile(record)
+    record['started'] = (time.perf_counter(), cpu_seconds())
+    PROFILE['stages'].append(record)
+    return record
+
+def end_profile_stage(record, **counts):
+    if record is None:
+        return
+    started_wall, started_cpu = record.pop('started')
+    record['wall_s'] = time.perf_counter() - started_wall
+    record['cpu_s'] = cpu_seconds() - started_cpu
+    end_rss_profile(record)
+    record.update(counts)
+
+def start_file_profile(file_name, size=None, timed=True):
+    """
+    Starts the record of one parsed file, size defaults to the file size on disk.
+    With timed=False the caller adds the wall / CPU time itself (async pipeline).
+    """
+    if PROFILE is None:
+        return None
+    if size is None:
+        try:
+            size = os.path.getsize(file_name)
+        except OSError:
+            pass
+    record = {'file': file_name, 'wall_s': 0.0, 'cpu_s': 0.0, 'bytes_in': size, 'bytes_out': 0,
+              'lines_in': 0, 'lines_out': 0, 'format': None}
+    start_rss_profile(record)
+    if timed:
+        record['started'] = (time.perf_counter(), time.thread_time())
+    PROFILE['files'].append(record)
+    return record
+
+def count_profile_items(items, record, key):
+    """Passes items through, counting them in record[key]."""
+    for item in items:
+        record[key] += 1
+        yield item
+
+def add_format_hits(detector):
+    hits = PROFILE['format_hits']
+    for index, (votes, fallbacks) in enumerate(zip(detector['votes'], detector['fallbacks'])):
+        hits[index] += votes + fallbacks
+    if detector['pinned'] is not None:
+        hits[detector['pinned']] += detector['hits']
+
+def end_file_profile(record, context, output_file_path):
+    if record is None:
+        return
+    if 'started' in record:
+        started_wall, started_cpu = record.pop('started')
+        record['wall_s'] += time.perf_counter() - started_wall
+        record['cpu_s'] += time.thread_time() - started_cpu
+    end_rss_profile(record)
+    if output_file_path is not None:
+        record['bytes_out'] = os.path.getsize(output_file_path)
+    record['format'] = context['detector']['pinned']
+    add_format_hits(context['detector'])
+
+def merge_profile(worker_profile):
+    """
+    Adds the file records and format hits of a --jobs worker to this process's profile.
+    The peak RSS of the worker's files counts towards the open stage records.
+    """
+    if PROFILE is None or worker_profile is None:
+        return
+    PROFILE['files'].extend(worker_profile['files'])
+    if PROFILE['rss_interval']:
+        add_peak_rss(max((record['peak_rss_kb'] or 0 for record in worker_profile['files']), default=None))
+    for index, hits in enumerate(worker_profile['format_hits']):
+        PROFILE['format_hits'][index] += hits
+
+def file_profile_totals():
+    """bytes_in / lines_in / lines_out summed over the parsed files, as stage counts."""
+    if PROFILE is None:
+        return {}
+    files = PROFILE['files']
+    return {
+        'bytes_in': sum(record['bytes_in'] or 0 for record in files),
+        'lines_in': sum(record['lines_in'] for record in files),
+        'lines_out': sum(record['lines_out'] for record in files),
+    }
+
+def path_size(path):
+    """Size of a file, or total size of the files under a directory."""
+    if os.path.isdir(path):
+        return sum(stat.st_size for _, stat in scan_files(path))
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+def write_profile_report(output_path, top_files=PROFILE_TOP_FILES):
+    """Writes the profile as JSON to output_path/profile.json and prints a human readable summary."""
+    if PROFILE is None:
+        return
+    total_hits = sum(PROFILE['format_hits']) or 1
+    report = {
+        'stages': PROFILE['stages'],
+        'files': sorted(PROFILE['files'], key=lambda record: record['wall_s'], reverse=True),
+        'format_hits': [
+            {'index': index, 'format': datetime_format, 'pattern': pattern.pattern, 'lines': hits}
+            for index, ((pattern, datetime_format), hits)
+            in enumerate(zip(TIMESTAMP_FORMAT_LIST, PROFILE['format_hits']))
+        ],
+        'peak_rss_kb': max((peak for peak in (PROFILE['peak_rss_kb'], peak_rss_kb(), read_peak_rss_kb())
+                            if peak is not None), default=None),
+        # 'interval': peak_rss_kb of a stage / file is its own peak, 'cumulative': only the process
+        # maximum at its start and end is known (max_rss_start_kb / max_rss_end_kb)
+        'peak_rss_kind': 'interval' if PROFILE['rss_interval'] else 'cumulative',
+    }
+    report_file = os.path.join(output_path, PROFILE_REPORT)
+    with open(report_file, 'w', encoding='utf-8') as outfile:
+        json.dump(report, outfile, indent=2)
+
+    def megabytes(value):
+        return "-" if value is None else f"{value / (1024 * 1024):.1f}"
+
+    def count(value):
+        return "-" if value is None else str(value)
+
+    def rss(record):
+        peak = record['peak_rss_kb'] if PROFILE['rss_interval'] else record.get('max_rss_end_kb')
+        return megabytes(None if peak is None else peak * 1024)
+
+    rss_label = 'peak RSS MB' if PROFILE['rss_interval'] else 'max RSS MB*'
+    print(f"\nProfile (full report in {report_file})")
+    print(f"{'stage':<14} {'wall s':>8} {'cpu s':>8} {'MB in':>8} {'MB out':>8} {'lines in':>10} {'lines out':>10} "
+          f"{rss_label:>11}")
+    for record in report['stages']:
+        print(f"{record['stage']:<14} {record['wall_s']:>8.2f} {record['cpu_s']:>8.2f} {megabytes(record['bytes_in']):>8} "
+              f"{megabytes(record['bytes_out']):>8} {count(record['lines_in']):>10} {count(record['lines_out']):>10} "
+              f"{rss(record):>11}")
+
+    print(f"\nTop {top_files} slowest files")
+    for record in report['files'][:top_files]:
+        print(f"{record['wall_s']:>8.2f}s {record['cpu_s']:>8.2f}s cpu {megabytes(record['bytes_in']):>8} MB "
+              f"{record['lines_in']:>10} lines {rss(record):>8} {rss_label[:-3]}  {record['file']}")
+    if not PROFILE['rss_interval']:
+        print(f"* cumulative maximum of the process at the end of the stage / file, not its own peak "
+              f"(needs {PROC_CLEAR_REFS})")
+
+    print(f"\nTimestamp format hits")
+    for entry in report['format_hits']:
+        if entry['lines']:
+            print(f"{entry['index']:>3} {entry['format']:<28} {entry['lines']:>10} {entry['lines'] / total_hits:>7.1%}")
+
+
+def process_file_group(files, change_hour, output_path, start_date, end_date, log_level=logging.INFO, cache_dir=None,
+                       profile=False, columnar=False, time_zone_rules=None, nodes=None, multiline=0):
+    """
+    Worker of the parallel mode: runs the serial per-file steps on a group of files,
+    dropping the lines outside start_date - end_date.
+    stdout and logging are captured so the parent can print each group as one block.
+
+    time_zone_rules, nodes and multiline are the parent's --tz_rule list, bundles and --multiline limit
+    (set_time_zone_rules(), set_nodes(), set_multiline()).
+
+    Returns:
+        tuple: (captured output, list of (file, error) pairs, the group's profile or None)
+    """
+    if profile:
+        enable_profile()
+    set_time_zone_rules(time_zone_rules)
+    set_nodes(nodes)
+    set_multiline(multiline)
+    buffer = io.StringIO()
+    handler = logging.StreamHandler(buffer)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    root_logger = logging.getLogger()
+    saved_handlers, saved_level = root_logger.handlers[:], root_logger.level
+    root_logger.handlers = [handler]
+    root_logger.setLevel(log_level)
+
+    errors = []
+    try:
+        with contextlib.redirect_stdout(buffer):
+            for file in files:
+                try:
+                    print(f"Working on {file}\n")
+                    process_log_source(file, change_hour, output_path, cache_dir, (start_date, end_date), columnar)
+                except Exception as e:
+                    errors.append((file, f"{type(e).__name__}: {e}"))
+    finally:
+        root_logger.handlers = saved_handlers
+        root_logger.setLevel(saved_level)
+    return buffer.getvalue(), errors, PROFILE if profile else None
+
+def process_files_parallel(files, change_hour, output_path, start_date, end_date, jobs, cache_dir=None,
+                           columnar=False):
+    """
+    Runs the per-file normalization on a process pool, largest inputs first.
+
+    Files sharing a base name (and node) write the same WIP file, so they are kept in one group and
+    processed in list order - the WIP outputs stay byte-identical to the serial loop.
+    Captured output is printed group by group in the original file order.
+
+    Returns:
+        list: (file, error) pairs of the files that failed.
+    """
+    groups = OrderedDict()
+    for file in files:
+        groups.setdefault(wip_file_path(output_path, file), []).append(file)
+    groups = list(groups.values())
+
+    def group_size(group):
+        size = 0
+        for file in group:
+            try:
+                size += os.path.getsize(file)
+            except OSError:
+                pass
+        return size
+
+    errors = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(jobs, len(groups)))) as executor:
+        futures = {}
+        for index in sorted(range(len(groups)), key=lambda i: group_size(groups[i]), reverse=True):
+            futures[index] = executor.submit(process_file_group, groups[index], change_hour, output_path,
+                                             start_date, end_date, logging.getLogger().level, cache_dir,
+                                             PROFILE is not None, columnar,
+                                             [rule for rule, _, _ in TIME_ZONE_RULES],
+                                             [(root, node.rstrip(), offset / 1000000) for root, node, offset in NODES],
+                                             MULTILINE)
+        for index in range(len(groups)):
+            try:
+                output, group_errors, group_profile = futures[index].result()
+            except Exception as e:
+                output, group_profile = "", None
+                group_errors = [(file, f"{type(e).__name__}: {e}") for file in groups[index]]
+            sys.stdout.write(output)
+            merge_profile(group_profile)
+            errors.extend(group_errors)
+
+    for file, error in errors:
+        logging.error(f"Failed processing '{file}': {error}")
+    return errors
+
+
+# Async pipeline: reading / decompression, parsing and writing run as three stages connected by
+# bounded queues, so while file N is parsed file N+1 is read and file N-1 written. Blocking calls
+# run on a small thread pool; gzip/bz2/lzma and file I/O release the GIL while they work.
+ASYNC_QUEUE_BATCHES = 8             # Batches buffered between two stages
+ASYNC_BATCH_BYTES = 1024 * 1024     # Raw bytes per batch handed from the reader to the parser
+
+def iter_raw_events(file_name, fileobj=None):
+    """Yields ('raw', file_name, raw lines) batches of about ASYNC_BATCH_BYTES of a log file."""
+    try:
+        with open_log_binary(file_name, fileobj) as log_file:
+            while True:
+                raw_lines = log_file.readlines(ASYNC_BATCH_BYTES)
+                if not raw_lines:
+                    break
+                yield 'raw', file_name, raw_lines
+    except FileNotFoundError:
+        logging.error(f"File '{file_name}' not found.")
+    except Exception as e:
+        logging.error(f"An error occurred while reading '{file_name}': {e}")
+
+def iter_file_events(files, window=None, change_hour=0):
+    """
+    Reader stage source for extracted files: yields ('start', file, (size, mtime)), the raw batches and
+    ('end', file, None) per file, or ('skip', file, None) for a file outside the window.
+    """
+    for file_name in files:
+        print(f"Working on {file_name}\n")
+        if window is not None and outside_window(file_name, window, change_hour):
+            logging.info(f"Skipping '{file_name}': outside {window[0]} - {window[1]}")
+            yield 'skip', file_name, None
+            continue
+        stat = os.stat(file_name)
+        yield 'start', file_name, (stat.st_size, stat.st_mtime)
+        yield from iter_raw_events(file_name)
+        yield 'end', file_name, None
+
+def iter_tar_events(tar_path, output_path, expand_tree, external_list_of_files, min_list_of_files, log_mode,
+                    start_date):
+    """iter_file_events() for archive mode: the selected members are streamed out of the tar file."""
+    try:
+        with tarfile.open(tar_path, 'r|*') as tar:
+            for path, member in iter_tar_log_members(tar, output_path, expand_tree, external_list_of_files,
+                                                     min_list_of_files, log_mode, start_date):
+                print(f"Working on {path}\n")
+                member_file = tar.extractfile(member)
+                if member_file is None:
+                    continue
+                with member_file:
+                    yield 'start', path, (member.size, member.mtime)
+                    yield from iter_raw_events(path, member_file)
+                    yield 'end', path, None
+    except (tarfile.TarError, OSError) as e:
+        print(f"Error reading tar file: {e}")
+
+def parse_raw_batch(raw_lines, context):
+    """Normalizes one batch of raw lines, returns the list of normalized lines."""
+    record = context.get('profile')
+    if record is not None:
+        started = time.thread_time()
+    processed_lines = []
+    lines_in = 0
+    for line in decode_raw_lines(raw_lines):
+        lines_in += 1
+        processed_line = normalize_line(line, context)
+        if processed_line is not None:
+            processed_lines.append(processed_line)
+    if record is not None:
+        record['cpu_s'] += time.thread_time() - started
+        record['lines_in'] += lines_in
+        record['lines_out'] += len(processed_lines)
+    return processed_lines
+
+def open_wip_file(output_path, file_name):
+    output_file_path = wip_file_path(output_path, file_name)
+    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+    output_file = open(output_file_path, 'w', encoding='utf-8', buffering=READ_BUFFER_SIZE)
+    output_file.write('\ufeff')  # Write BOM for UTF-8
+    return output_file
+
+def new_stage_stats():
+    """Timings of one stage: time spent in its blocking calls and waiting on its input / output queue."""
+    return {'busy': 0.0, 'waiting_input': 0.0, 'waiting_output': 0.0, 'batches': 0}
+
+async def run_blocking(executor, stats, function, *args):
+    started = time.perf_counter()
+    result = await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+    stats['busy'] += time.perf_counter() - started
+    return result
+
+async def get_item(queue, stats):
+    started = time.perf_counter()
+    item = await queue.get()
+    stats['waiting_input'] += time.perf_counter() - started
+    return item
+
+async def put_item(queue, item, stats):
+    started = time.perf_counter()
+    await queue.put(item)
+    stats['waiting_output'] += time.perf_counter() - started
+
+async def read_stage(executor, events, out_queue, stats):
+    while True:
+        event = await run_blocking(executor, stats, next, events, None)
+        if event is None:
+            break
+        if event[0] == 'raw':
+            stats['batches'] += 1
+        await put_item(out_queue, event + (time.perf_counter(),), stats)
+    await out_queue.put(None)
+
+async def parse_stage(executor, in_queue, out_queue, stats, change_hour, window):
+    context = None
+    while True:
+        item = await get_item(in_queue, stats)
+        if item is None:
+            break
+        kind, file_name, payload, read_time = item
+        if kind == 'start':
+            size, mtime = payload
+            context = new_line_context(file_name, change_hour, window, mtime)
+            context['profile'] = start_file_profile(file_name, size, timed=False)
+        elif kind == 'raw':
+            stats['batches'] += 1
+            started = time.perf_counter()
+            payload = await run_blocking(executor, stats, parse_raw_batch, payload, context)
+            if context['profile'] is not None:
+                context['profile']['wall_s'] += time.perf_counter() - started
+        elif kind == 'end':
+            log_line_context(context)
+            payload = context
+        await put_item(out_queue, (kind, file_name, payload, read_time), stats)
+    await out_queue.put(None)
+
+async def write_stage(executor, in_queue, stats, latency, output_path):
+    """
+    Writes the WIP files with the same rules as save_processed_lines() / process_log_file(): a file
+    is only (re)written once it has lines, one whose lines were all out of the window discards its WIP file.
+    """
+    output_file = None
+    while True:
+        item = await get_item(in_queue, stats)
+        if item is None:
+            break
+        kind, file_name, payload, read_time = item
+        if kind == 'raw' and payload:
+            stats['batches'] += 1
+            if output_file is None:
+                output_file = await run_blocking(executor, stats, open_wip_file, output_path, file_name)
+            await run_blocking(executor, stats, output_file.writelines, payload)
+            elapsed = time.perf_counter() - read_time
+            latency['batches'] += 1
+            latency['total'] += elapsed
+            latency['max'] = max(latency['max'], elapsed)
+        elif kind == 'end':
+            output_file_path = None
+            if output_file is not None:
+                output_file_path = output_file.name
+                await run_blocking(executor, stats, output_file.close)
+                output_file = None
+            elif payload['dropped']:
+                discard_wip_file(file_name, output_path)
+            else:
+                logging.error(f"No processed lines to save for file '{file_name}'.")
+            end_file_profile(payload['profile'], payload, output_file_path)
+        elif kind == 'skip':
+            discard_wip_file(file_name, output_path)
+
+async def async_pipeline(events, change_hour, output_path, window):
+    stats = OrderedDict((name, new_stage_stats()) for name in ('read', 'parse', 'write'))
+    latency = {'batches': 0, 'total': 0.0, 'max': 0.0}
+    raw_queue = asyncio.Queue(maxsize=ASYNC_QUEUE_BATCHES)
+    line_queue = asyncio.Queue(maxsize=ASYNC_QUEUE_BATCHES)
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        await asyncio.gather(read_stage(executor, events, raw_queue, stats['read']),
+                             parse_stage(executor, raw_queue, line_queue, stats['parse'], change_hour, window),
+                             write_stage(executor, line_queue, stats['write'], latency, output_path))
+    log_stage_stats(stats, latency, time.perf_counter() - started)
+    return stats
+
+def log_stage_stats(stats, latency, elapsed):
+    logging.info(f"Async pipeline finished in {elapsed:.2f}s")
+    for name, stage in stats.items():
+        per_batch = stage['busy'] / stage['batches'] * 1000 if stage['batches'] else 0.0
+        logging.info(f"    {name:<5} busy {stage['busy']:7.2f}s, waiting for input {stage['waiting_input']:7.2f}s, "
+                     f"waiting for output {stage['waiting_output']:7.2f}s, {stage['batches']} batches "
+                     f"({per_batch:.1f} ms/batch)")
+    if latency['batches']:
+        logging.info(f"    batch latency read -> written: mean {latency['total'] / latency['batches'] * 1000:.1f} ms, "
+                     f"max {latency['max'] * 1000:.1f} ms")
+
+def run_async_pipeline(events, change_hour, output_path, window=None):
+    """
+    Processes the files of events (iter_file_events() / iter_tar_events()) on the async pipeline.
+    The WIP files are the same as the serial loop writes. Stage timings are logged at the end.
+
+    Returns:
+        dict: Per stage busy / waiting times and batch counts.
+    """
+    return asyncio.run(async_pipeline(events, change_hour, output_path, window))
 
 
 def parse_timestamp_from_line(line):
@@ -247,6 +1700,105 @@ def zcat(input_file):
     return output_file
 
 
+# File discovery: one os.scandir traversal with cached stat results and precompiled path filters
+MIN_LOG_FILE_SIZE = 200     # Ignore samll files <200 Bytes
+GLOB_CHARACTERS = re.compile(r"[*?\[]")
+
+def glob_to_regex(pattern):
+    """
+    Regex source of a glob used as a path substring: '*' and '?' stay within one path
+    component, '[...]' is a character class ('[!...]' negated).
+    """
+    parts = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '*':
+            parts.append('[^/]*')
+        elif char == '?':
+            parts.append('[^/]')
+        elif char == '[' and ']' in pattern[index + 2:]:
+            close = pattern.index(']', index + 2)
+            members = pattern[index + 1:close]
+            if members.startswith('!'):
+                members = '^' + members[1:]
+            parts.append('[' + members.replace('\\', '\\\\') + ']')
+            index = close
+        else:
+            parts.append(re.escape(char))
+        index += 1
+    return ''.join(parts)
+
+def compile_path_patterns(patterns):
+    """
+    Compiles a list of path substrings (entries with glob characters are real globs) into one
+    alternation regex, so a path is checked against all of them in a single search.
+    Returns None for an empty list.
+    """
+    sources = [glob_to_regex(pattern) if GLOB_CHARACTERS.search(pattern) else re.escape(pattern)
+               for pattern in patterns]
+    # Longer alternatives first, so a shared prefix never hides a longer entry
+    sources.sort(key=len, reverse=True)
+    return re.compile('|'.join(sources)) if sources else None
+
+def scan_files(expand_tree, exclude=None, include=None, min_size=0, modified_after=None, last_week_relative=False):
+    """
+    Recursively lists the files of expand_tree in os.walk order with a single os.scandir traversal,
+    applying the filters on the way. Every file is stat-ed once.
+
+    :param exclude: Compiled path patterns (compile_path_patterns) of the files to leave out.
+    :param include: Compiled path patterns a file must match, None keeps all.
+    :param min_size: Minimal file size in bytes.
+    :param modified_after: datetime the file modification time must be after, None keeps all.
+    :param last_week_relative: Keep only files modified in the week before the newest file of the tree.
+    :return: A list of (file path, os.stat_result).
+    """
+    result = []
+    latest_mtime = 0
+    modified_after_timestamp = modified_after.timestamp() if modified_after is not None else None
+
+    def scan(directory):
+        nonlocal latest_mtime
+        subdirectories = []
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                is_directory = entry.is_dir()
+            except OSError:
+                is_directory = False
+            if is_directory:
+                if not entry.is_symlink():
+                    subdirectories.append(entry.path)
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue    # Broken symlink
+            latest_mtime = max(latest_mtime, stat.st_mtime)
+            path = entry.path
+            if stat.st_size < min_size:
+                continue
+            if exclude is not None and exclude.search(path):
+                continue
+            if include is not None and not include.search(path):
+                continue
+            if modified_after_timestamp is not None and stat.st_mtime <= modified_after_timestamp:
+                continue
+            result.append((path, stat))
+        for subdirectory in subdirectories:
+            scan(subdirectory)
+
+    scan(expand_tree)
+
+    if last_week_relative:
+        # One week before the latest modification time
+        threshold_time = latest_mtime - 7 * 24 * 60 * 60
+        result = [(path, stat) for path, stat in result if stat.st_mtime >= threshold_time]
+    return result
+
 def get_all_files(expand_tree, last_week_relative=False):
     """
     Recursively retrieves a list of all files in the specified directory and its sub-directories.
@@ -256,29 +1808,7 @@ def get_all_files(expand_tree, last_week_relative=False):
     :param last_week_relative: Boolean flag to filter files modified in the last week relative to the newest file.
     :return: A list of file paths.
     """
-    result = []
-    latest_mtime = 0
-
-    # First pass to find the latest modification time
-    for root, _, filenames in os.walk(expand_tree):
-        for filename in filenames:
-            file_path = os.path.join(root, filename)
-            mtime = os.path.getmtime(file_path)
-            if mtime > latest_mtime:
-                latest_mtime = mtime
-
-    # Calculate the threshold time (one week before the latest modification time)
-    one_week_seconds = 7 * 24 * 60 * 60
-    threshold_time = latest_mtime - one_week_seconds
-
-    # Second pass to collect files based on the threshold time
-    for root, _, filenames in os.walk(expand_tree):
-        for filename in filenames:
-            file_path = os.path.join(root, filename)
-            if not last_week_relative or os.path.getmtime(file_path) >= threshold_time:
-                result.append(file_path)
-
-    return result
+    return [path for path, _ in scan_files(expand_tree, last_week_relative=last_week_relative)]
      
 
 def read_contents_from_files(all_files):
@@ -294,13 +1824,76 @@ def read_contents_from_files(all_files):
     return all_lines
 
 
+# Layered encoding detection: BOM, then strict UTF-8 on a sample, then chardet on a bounded prefix
+ENCODING_SAMPLE_BYTES = 1024 * 1024
+CHARDET_SAMPLE_BYTES = 64 * 1024
+BYTE_ORDER_MARKS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),    # Checked before UTF-16, its BOM starts with the UTF-16 LE one
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# Detected encodings by (path, size, mtime)
+file_encodings = {}
+
 def detect_encoding(raw_data):
     """
     Detects the encoding of the given raw data.
-    here 
+    Falls back to latin-1 (which decodes any byte) when chardet is not installed or unsure.
     """
+    if chardet is None:
+        return 'latin-1'
     result = chardet.detect(raw_data)
-    return result['encoding']
+    return result['encoding'] or 'latin-1'
+
+def is_utf8_sample(sample):
+    """Strict UTF-8 check of a sample that may end in the middle of a character."""
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+def detect_file_encoding(file):
+    """
+    Detects the encoding of a file from its first bytes only, the result is cached per file.
+    """
+    stat = os.stat(file)
+    cache_key = (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+    encoding = file_encodings.get(cache_key)
+    if encoding is not None:
+        return encoding
+
+    with open(file, 'rb') as f:
+        sample = f.read(ENCODING_SAMPLE_BYTES)
+    for bom, bom_encoding in BYTE_ORDER_MARKS:
+        if sample.startswith(bom):
+            encoding = bom_encoding
+            break
+    else:
+        if is_utf8_sample(sample):
+            encoding = 'utf-8'
+        else:
+            encoding = detect_encoding(sample[:CHARDET_SAMPLE_BYTES])
+
+    file_encodings[cache_key] = encoding
+    return encoding
+
+def open_text_file(file):
+    """Opens a file for reading as text in its detected encoding."""
+    return open(file, 'r', encoding=detect_file_encoding(file), errors='replace', buffering=READ_BUFFER_SIZE)
+
+def iter_file_content(file):
+    """
+    Yields the lines of a file (without line breaks, as str.splitlines() splits them),
+    decoding it in streamed chunks.
+    """
+    with open(file, 'r', encoding=detect_file_encoding(file), errors='replace', newline='',
+              buffering=READ_BUFFER_SIZE) as f:
+        for line in f:
+            yield from line.splitlines()
 
 def read_file_content(file):
     """
@@ -308,12 +1901,7 @@ def read_file_content(file):
     Returns a list of lines in the file.
     """
     try:
-        with open(file, 'rb') as f:
-            raw_data = f.read()
-            encoding = detect_encoding(raw_data)
-            content = raw_data.decode(encoding, errors='replace')
-            lines = content.splitlines()  # Split content into lines
-            return lines
+        return list(iter_file_content(file))
     except Exception as e:
         logging.error(f"Error reading {file}: {e}")
         return None
@@ -377,29 +1965,421 @@ def update_timestamps_and_filter_lines(content):
 
     
 
-def reorder_lines(input_file, output_file):
-    lines_with_timestamps = []
-    lines_without_timestamps = []
+def reorder_lines(input_file, output_file, memory_budget=None):
+    """Writes the lines of a normalized file ordered by timestamp (stable) to output_file, in bounded memory."""
+    merge_sorted_files([input_file], output_file, memory_budget)
+
+
+# Streaming k-way merge of the per-file WIP outputs. A WIP file that is not ordered is sorted in
+# memory when it fits the --sort_memory_mb budget, otherwise by an external sort: the sort keys and
+# byte offsets of its lines are sorted in budget-sized chunks, spilled as fixed size records (the
+# 27 key bytes, a 5-byte offset and a 4-byte length, so records compare as bytes in (key, offset)
+# order, which keeps lines with equal timestamps in file order), heap-merged, and the lines read
+# back in that order.
+MERGE_MAX_OPEN_FILES = 256      # Max runs merged at once, larger sets are merged in passes
+SORT_MEMORY_MB = 256            # Default memory budget of sorting a WIP file that is not ordered
+SORT_MEMORY_FACTOR = 3          # Memory of sorting a file as Python lines, per byte of the file
+SORT_KEY_BYTES = 27             # log_sort_key() of a line
+SORT_RECORD_BYTES = 36          # Spilled record: sort key + 5-byte offset + 4-byte length (big endian)
+SORT_RECORD_MEMORY = 100        # Memory per record while a chunk is sorted (bytes object + list slot)
+
+def log_sort_key(line):
+    """
+    Sort key of a normalized line: its timestamp column, including the '*' year marker.
+    Lines with the same timestamp keep their input order (heapq.merge and sorted() are stable).
+    """
+    return line[:27]
 
-    with open(input_file, 'r') as infile:
+def iter_log_lines(stream):
+    """
+    Yields the non-empty lines of a normalized log stream, each terminated by a newline.
+    A line is yielded together with the '\t' continuation lines after it (--multiline), as one record.
+    """
+    pending = parts = None
+    for line in stream:
+        if not line.strip():
+            continue
+        if not line.endswith('\n'):
+            line += '\n'
+        if line[0] == '\t' and pending is not None:
+            if parts is None:
+                parts = [pending]
+            parts.append(line)
+            continue
+        if pending is not None:
+            yield pending if parts is None else ''.join(parts)
+            parts = None
+        pending = line
+    if pending is not None:
+        yield pending if parts is None else ''.join(parts)
+
+def is_sorted_file(file_name):
+    """Checks in one streaming pass whether a normalized file is already ordered by timestamp."""
+    previous_key = ''
+    with open_text_file(file_name) as infile:
+        for line in iter_log_lines(infile):
+            key = log_sort_key(line)
+            if key < previous_key:
+                return False
+            previous_key = key
+    return True
+
+def iter_sort_records(run_path):
+    """Yields the SORT_RECORD_BYTES records of a spilled run file."""
+    with open(run_path, 'rb') as infile:
+        while True:
+            data = infile.read(SORT_RECORD_BYTES * 8192)
+            if not data:
+                return
+            for start in range(0, len(data), SORT_RECORD_BYTES):
+                yield data[start:start + SORT_RECORD_BYTES]
+
+def write_sort_records(records, run_path):
+    with open(run_path, 'wb', buffering=READ_BUFFER_SIZE) as outfile:
+        for batch in iter(lambda: list(itertools.islice(records, 8192)), []):
+            outfile.write(b''.join(batch))
+
+def external_sort_file(file_name, tmp_dir, memory_budget):
+    """
+    Sorts a normalized file too large to sort in memory into one run in tmp_dir: only (key, offset)
+    records are sorted and spilled, memory_budget bounds the records held at once. A record spans a
+    line and its '\t' continuation lines. Returns the run path.
+    """
+    chunk_records = max(1, memory_budget // SORT_RECORD_MEMORY)
+    record_runs = []
+
+    def spill(records):
+        records.sort()
+        run_path = os.path.join(tmp_dir, f"keys_{len(os.listdir(tmp_dir)):06d}.bin")
+        write_sort_records(iter(records), run_path)
+        record_runs.append(run_path)
+
+    with open(file_name, 'rb', buffering=READ_BUFFER_SIZE) as infile:
+        # WIP files start with a UTF-8 BOM, it must not become part of the first sort key and line
+        offset = len(codecs.BOM_UTF8) if infile.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8 else 0
+        infile.seek(offset)
+        records = []
         for line in infile:
-            timestamp= line.strip()
-            if timestamp:
-                lines_with_timestamps.append((timestamp, line))
-            else:
-                lines_without_timestamps.append(line)
+            if line[:1] == b'\t' and records:
+                # A continuation line (--multiline) extends the record before it
+                length = int.from_bytes(records[-1][SORT_KEY_BYTES + 5:], 'big') + len(line)
+                records[-1] = records[-1][:SORT_KEY_BYTES + 5] + length.to_bytes(4, 'big')
+            elif line.strip():
+                if len(records) >= chunk_records:
+                    spill(records)
+                    records = []
+                records.append(line[:SORT_KEY_BYTES].ljust(SORT_KEY_BYTES, b'\0') + offset.to_bytes(5, 'big')
+                               + len(line).to_bytes(4, 'big'))
+            offset += len(line)
+        if records:
+            spill(records)
+        del records
+
+    # Keep the number of simultaneously open runs bounded
+    while len(record_runs) > MERGE_MAX_OPEN_FILES:
+        merged_runs = []
+        for start in range(0, len(record_runs), MERGE_MAX_OPEN_FILES):
+            run_path = os.path.join(tmp_dir, f"keys_{len(os.listdir(tmp_dir)):06d}.bin")
+            write_sort_records(heapq.merge(*(iter_sort_records(run) for run in
+                                             record_runs[start:start + MERGE_MAX_OPEN_FILES])), run_path)
+            merged_runs.append(run_path)
+        record_runs = merged_runs
+
+    run_path = os.path.join(tmp_dir, f"run_{len(os.listdir(tmp_dir)):06d}.txt")
+    with open(file_name, 'rb') as infile, open(run_path, 'wb', buffering=READ_BUFFER_SIZE) as outfile:
+        descriptor = infile.fileno()
+        for record in heapq.merge(*(iter_sort_records(run) for run in record_runs)):
+            line = os.pread(descriptor, int.from_bytes(record[SORT_KEY_BYTES + 5:], 'big'),
+                            int.from_bytes(record[SORT_KEY_BYTES:SORT_KEY_BYTES + 5], 'big'))
+            outfile.write(line if line.endswith(b'\n') else line + b'\n')
+    return run_path
+
+def split_sorted_runs(file_name, tmp_dir, memory_budget=SORT_MEMORY_MB * 1024 * 1024):
+    """
+    Returns a list of sorted runs covering the file.
+    An already sorted file is its own single run. Otherwise it is sorted into one run in tmp_dir,
+    in memory when its estimated sort memory fits memory_budget, by external_sort_file() when not.
+    """
+    if is_sorted_file(file_name):
+        return [file_name]
 
-    # Sort lines with timestamps by timestamp
-    sorted_lines = sorted(lines_with_timestamps, key=lambda x: x[0])
+    if os.path.getsize(file_name) * SORT_MEMORY_FACTOR > memory_budget:
+        logging.info(f"'{file_name}' is not ordered and larger than the sort memory budget, sorting it externally")
+        return [external_sort_file(file_name, tmp_dir, memory_budget)]
 
-    # Write the sorted contents to the output file
-    with open(output_file, 'w') as outfile:
-        for _, line in sorted_lines:
-            outfile.write(line)
-#        for line in lines_without_timestamps:
-#            outfile.write(line)
-#    print(f"Sorted contents written to '{output_file}'.")
+    run_path = os.path.join(tmp_dir, f"run_{len(os.listdir(tmp_dir)):06d}.txt")
+    with open_text_file(file_name) as infile:
+        lines = sorted(iter_log_lines(infile), key=log_sort_key)
+    with open(run_path, 'w', encoding='utf-8') as run_file:
+        run_file.writelines(lines)
+    return [run_path]
 
+def merge_runs(runs, output_file, index_file=None):
+    """
+    Merges sorted runs into output_file with a heap, holding one line per run in memory.
+    When index_file is set the sparse timestamp index of the output is written along.
+    """
+    with contextlib.ExitStack() as stack:
+        streams = [iter_log_lines(stack.enter_context(open_text_file(run))) for run in runs]
+        merged = heapq.merge(*streams, key=log_sort_key)
+        if index_file is None:
+            with open(output_file, 'w', encoding='utf-8') as outfile:
+                outfile.writelines(merged)
+            return
+
+        index = new_sorted_log_index()
+        with open(output_file, 'wb') as outfile:
+            position = 0
+            for line in merged:
+                data = line.encode('utf-8')
+                add_to_sorted_log_index(index, line, position)
+                outfile.write(data)
+                position += len(data)
+        write_sorted_log_index(index, index_file)
+
+def merge_sorted_files(input_files, output_file, memory_budget=None, index_file=None):
+    """
+    Writes the timestamp ordered merge of all input files to output_file.
+    Each input is expected to be almost sorted, so memory stays O(number of files) instead of O(total lines).
+
+    Args:
+        input_files (list): Normalized per-file outputs (the WIP files).
+        output_file (str): Path of the merged file.
+        memory_budget (int): Bytes of memory for sorting an input that is not ordered (SORT_MEMORY_MB by default).
+        index_file (str): Optional path of the sparse timestamp index written for output_file.
+    """
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_file))) as tmp_dir:
+        runs = []
+        for file in input_files:
+            runs.extend(split_sorted_runs(file, tmp_dir, memory_budget or SORT_MEMORY_MB * 1024 * 1024))
+
+        # Keep the number of simultaneously open files bounded
+        while len(runs) > MERGE_MAX_OPEN_FILES:
+            merged_runs = []
+            for start in range(0, len(runs), MERGE_MAX_OPEN_FILES):
+                run_path = os.path.join(tmp_dir, f"merged_{len(os.listdir(tmp_dir)):06d}.txt")
+                merge_runs(runs[start:start + MERGE_MAX_OPEN_FILES], run_path)
+                merged_runs.append(run_path)
+            runs = merged_runs
+
+        merge_runs(runs, output_file, index_file)
+
+
+
+# Columnar intermediate (--intermediate columnar): WIP files hold columns instead of text lines,
+# so the merge orders integer keys and text is only rendered for sorted_log.txt.
+# Layout, native byte order, every column 8-byte aligned so a chunk can be used straight from mmap:
+#   COLUMNAR_MAGIC, source length (int64) + source (the padded file_base, UTF-8, padded to 8 bytes)
+#   per chunk: record count, blob size (int64), epoch-microsecond timestamps (int64),
+#   year-corrected flags (uint8, padded to 8 bytes), message end offsets (int64), message blob (UTF-8)
+# A WIP file has a single source, it is stored once; in the merge a record refers to it by its run.
+# A run merged from several sources (merge passes) stores an empty source and 'source ' before every message.
+COLUMNAR_MAGIC = b'TTCOL001'
+COLUMNAR_CHUNK_RECORDS = 8192     # Records per chunk, the merge holds one chunk per run in memory
+COLUMNAR_RENDER_RECORDS = 512     # Records of a run rendered to text at once by the merge
+COLUMNAR_SORT_RECORD_MEMORY = 300 # Memory per record tuple while a run is sorted
+
+def padding(size):
+    return b'\0' * (-size % 8)
+
+def write_columnar_header(outfile, source):
+    outfile.write(COLUMNAR_MAGIC)
+    array.array('q', [len(source)]).tofile(outfile)
+    outfile.write(source + padding(len(source)))
+
+def write_columnar_chunk(outfile, keys, flags, messages):
+    """Writes one chunk: keys (int64 epoch-microseconds), flags (0/1) and messages (UTF-8 bytes)."""
+    offsets = array.array('q', itertools.accumulate(len(message) for message in messages))
+    blob = b''.join(messages)
+    array.array('q', [len(keys), len(blob)]).tofile(outfile)
+    array.array('q', keys).tofile(outfile)
+    outfile.write(bytes(flags) + padding(len(flags)))
+    offsets.tofile(outfile)
+    outfile.write(blob + padding(len(blob)))
+
+def save_columnar_records(records, output_path, file_name, source):
+    """
+    save_processed_lines() for the columnar intermediate: writes normalize_record() tuples
+    in chunks of COLUMNAR_CHUNK_RECORDS. Returns the written file path.
+    """
+    records = iter(records)
+    chunk = list(itertools.islice(records, COLUMNAR_CHUNK_RECORDS))
+    if not chunk:
+        logging.error(f"No processed lines to save for file '{file_name}'.")
+        return
+
+    try:
+        output_file_path = wip_file_path(output_path, file_name)
+        os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+        with open(output_file_path, 'wb', buffering=READ_BUFFER_SIZE) as output_file:
+            write_columnar_header(output_file, source.encode('utf-8'))
+            while chunk:
+                write_columnar_chunk(output_file,
+                                     [timestamp_key(fields) for fields, _, _ in chunk],
+                                     [1 if marker else 0 for _, marker, _ in chunk],
+                                     [message.encode('utf-8') for _, _, message in chunk])
+                chunk = list(itertools.islice(records, COLUMNAR_CHUNK_RECORDS))
+        return output_file_path
+    except Exception as e:
+        logging.error(f"An error occurred while saving '{file_name}': {e}")
+
+def read_columnar_file(file_name):
+    """
+    Reads a columnar file through mmap. Returns (source as UTF-8 bytes, chunks); chunks is a generator of
+    (keys, flags, offsets, blob) - int64 arrays, the flags and blob as bytes - one chunk in memory at a time.
+    """
+    def read_array(mapped, position, count):
+        values = array.array('q')
+        values.frombytes(mapped[position:position + 8 * count])
+        return values, position + 8 * count
+
+    with open(file_name, 'rb') as infile:
+        mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    position = len(COLUMNAR_MAGIC)
+    (source_size,), position = read_array(mapped, position, 1)
+    source = mapped[position:position + source_size]
+    position += source_size + len(padding(source_size))
+
+    def chunks(position):
+        with mapped:
+            while position < len(mapped):
+                (count, blob_size), position = read_array(mapped, position, 2)
+                keys, position = read_array(mapped, position, count)
+                flags = mapped[position:position + count]
+                position += count + len(padding(count))
+                offsets, position = read_array(mapped, position, count)
+                blob = mapped[position:position + blob_size]
+                position += blob_size + len(padding(blob_size))
+                yield keys, flags, offsets, blob
+
+    return source, chunks(position)
+
+def iter_columnar_records(file_name):
+    """
+    Yields (sort key, epoch-microseconds, flag, source, message) per record of a columnar file.
+    The sort key (timestamp * 2 + flag) orders like the text timestamp column with its '*' marker.
+    """
+    source, chunks = read_columnar_file(file_name)
+    for keys, flags, offsets, blob in chunks:
+        start = 0
+        for key, flag, end in zip(keys, flags, offsets):
+            yield key * 2 + flag, key, flag, source, blob[start:end]
+            start = end
+
+def write_columnar_records(records, file_name, source):
+    """Writes (sort key, epoch-microseconds, flag, source, message) records of one source as a columnar file."""
+    records = iter(records)
+    with open(file_name, 'wb', buffering=READ_BUFFER_SIZE) as outfile:
+        write_columnar_header(outfile, source)
+        while True:
+            chunk = list(itertools.islice(records, COLUMNAR_CHUNK_RECORDS))
+            if not chunk:
+                break
+            write_columnar_chunk(outfile, [record[1] for record in chunk], [record[2] for record in chunk],
+                                 [record[4] for record in chunk])
+
+def split_sorted_columnar_runs(file_name, tmp_dir, memory_budget=SORT_MEMORY_MB * 1024 * 1024):
+    """
+    split_sorted_runs() for a columnar file, comparing integer keys. The records are already compact,
+    a file that is not ordered is cut into sorted runs of as many records as memory_budget holds.
+    """
+    previous_key = None
+    for sort_key, _, _, source, _ in iter_columnar_records(file_name):
+        if previous_key is not None and sort_key < previous_key:
+            break
+        previous_key = sort_key
+    else:
+        return [file_name]
+
+    runs = []
+    records = iter_columnar_records(file_name)
+    while True:
+        chunk = sorted(itertools.islice(records, max(1, memory_budget // COLUMNAR_SORT_RECORD_MEMORY)),
+                       key=operator.itemgetter(0))
+        if not chunk:
+            break
+        run_path = os.path.join(tmp_dir, f"run_{len(os.listdir(tmp_dir)):06d}.col")
+        write_columnar_records(chunk, run_path, source)
+        runs.append(run_path)
+    return runs
+
+def iter_columnar_lines(file_name, clock, dates):
+    """
+    Yields (sort key, rendered text line as bytes) per record of a columnar file, rendered
+    COLUMNAR_RENDER_RECORDS at a time (cheaper than resuming the generator inside the render loop).
+    clock holds the b'HH:MM:SS.' of every second of a day, dates caches b'YYYY-mm-dd ' per epoch day;
+    both are shared by all the runs of a merge.
+    """
+    source, chunks = read_columnar_file(file_name)
+    separator = b"  " + source + b" " if source else b"  "
+    for keys, flags, offsets, blob in chunks:
+        start = 0
+        for first in range(0, len(keys), COLUMNAR_RENDER_RECORDS):
+            last = first + COLUMNAR_RENDER_RECORDS
+            lines = []
+            for key, flag, end in zip(keys[first:last], flags[first:last], offsets[first:last]):
+                second, microsecond = divmod(key, 1000000)
+                day, second = divmod(second, 86400)
+                date = dates.get(day)
+                if date is None:
+                    date = dates[day] = b"%04d-%02d-%02d " % civil_from_days(day)
+                lines.append((key * 2 + flag, b"%s%s%06d%s%s%s\n" % (date, clock[second], microsecond,
+                                                                      b'*' if flag else b'', separator, blob[start:end])))
+                start = end
+            yield from lines
+
+def merge_columnar_runs(runs, run_path):
+    """Merges columnar runs of any sources into one run file, each message keeping its source in front."""
+    records = heapq.merge(*(iter_columnar_records(run) for run in runs), key=operator.itemgetter(0))
+    write_columnar_records(((sort_key, key, flag, b'', source + b" " + message if source else message)
+                            for sort_key, key, flag, source, message in records), run_path, b'')
+
+def merge_columnar_files(input_files, output_file, memory_budget=None, index_file=None, trim=None):
+    """
+    merge_sorted_files() for columnar WIP files: the runs are merged on integer keys and each
+    line is rendered to text once, as it is written to output_file (the same bytes as the text path).
+    trim optionally is (start_date, end_date, trim_file): the lines in that window are also written
+    to trim_file, selected by integer key instead of a trim_sorted_log() pass.
+    """
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_file))) as tmp_dir:
+        runs = []
+        for file in input_files:
+            runs.extend(split_sorted_columnar_runs(file, tmp_dir, memory_budget or SORT_MEMORY_MB * 1024 * 1024))
+        # Every run holds an mmap, and so a file descriptor, while it is merged: keep their number bounded
+        while len(runs) > MERGE_MAX_OPEN_FILES:
+            merged_runs = []
+            for start in range(0, len(runs), MERGE_MAX_OPEN_FILES):
+                run_path = os.path.join(tmp_dir, f"merged_{len(os.listdir(tmp_dir)):06d}.col")
+                merge_columnar_runs(runs[start:start + MERGE_MAX_OPEN_FILES], run_path)
+                merged_runs.append(run_path)
+            runs = merged_runs
+
+        clock = [b"%02d:%02d:%02d." % (second // 3600, second // 60 % 60, second % 60) for second in range(86400)]
+        dates = {}
+        merged = heapq.merge(*(iter_columnar_lines(run, clock, dates) for run in runs), key=operator.itemgetter(0))
+
+        if trim is not None:
+            # Whole seconds start_date - end_date as a sort key range, the '*' flag included
+            start_date, end_date, trim_file = trim
+            start_second, end_second = (timestamp_key(bound + (0,)) // 1000000
+                                        for bound in window_fields((start_date, end_date)))
+            start_key, end_key = start_second * 2000000, (end_second + 1) * 2000000 - 1
+        index = new_sorted_log_index() if index_file is not None else None
+        with open(output_file, 'wb', buffering=READ_BUFFER_SIZE) as outfile, \
+                (open(trim_file, 'wb', buffering=READ_BUFFER_SIZE) if trim is not None else contextlib.nullcontext()) \
+                as trimfile:
+            position = 0
+            for sort_key, line in merged:
+                if index is not None:
+                    add_to_sorted_log_index(index, line, position, sort_key >> 1)
+                outfile.write(line)
+                position += len(line)
+                if trim is not None and start_key <= sort_key <= end_key:
+                    trimfile.write(line)
+        if index is not None:
+            write_sorted_log_index(index, index_file)
+        if trim is not None:
+            print(f"Filtered log saved to {trim_file}")
 
 
 def filter_log_by_timestamp(input_file, start_date, end_date, output_file):
@@ -428,26 +2408,807 @@ def filter_log_by_timestamp(input_file, start_date, end_date, output_file):
 # filter_log_by_timestamp('input.log', '2023-01-01 00:00:00', '2023-01-31 23:59:59', 'output.log')
 
 
+# Time window trimming of a sorted file by bisecting on byte offsets
+SORTED_LINE_START = re.compile(rb"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+
+def next_line_start(infile, offset):
+    """
+    Returns (position, first 19 bytes) of the first line starting at or after offset whose
+    beginning is a timestamp, or (None, None) at the end of the file.
+    Lines without a timestamp (bad or continuation lines) are skipped.
+    """
+    if offset > 0:
+        infile.seek(offset - 1)
+        infile.readline()   # Re-sync to the start of the next line
+    else:
+        infile.seek(0)
+    while True:
+        position = infile.tell()
+        line = infile.readline()
+        if not line:
+            return None, None
+        if SORTED_LINE_START.match(line):
+            return position, line[:19]
+
+def bisect_sorted_log(infile, file_size, is_after):
+    """
+    Byte offset of the first line for which is_after(timestamp) is true, in a file sorted by timestamp.
+    Costs O(log N) line reads instead of a full scan.
+    """
+    low, high = 0, file_size
+    while low < high:
+        middle = (low + high) // 2
+        position, timestamp = next_line_start(infile, middle)
+        if position is None or is_after(timestamp):
+            high = middle
+        else:
+            low = position + 1
+    position, _ = next_line_start(infile, low)
+    return file_size if position is None else position
+
+def copy_file_range(input_file, output_file, start, end):
+    """Copies bytes [start, end) between files, zero-copy in the kernel when the platform allows it."""
+    with open(input_file, 'rb') as infile, open(output_file, 'wb') as outfile:
+        in_fd, out_fd = infile.fileno(), outfile.fileno()
+        offset = start
+        try:
+            while offset < end:
+                if hasattr(os, 'copy_file_range'):
+                    copied = os.copy_file_range(in_fd, out_fd, end - offset, offset)
+                else:
+                    copied = os.sendfile(out_fd, in_fd, offset, end - offset)
+                if copied == 0:
+                    break
+                offset += copied
+        except OSError:
+            # Fall back to a plain buffered copy of what is left
+            outfile.seek(offset - start)
+            infile.seek(offset)
+            while offset < end:
+                chunk = infile.read(min(READ_BUFFER_SIZE, end - offset))
+                if not chunk:
+                    break
+                outfile.write(chunk)
+                offset += len(chunk)
+
+def trim_sorted_log(input_file, start_date, end_date, output_file):
+    """
+    filter_log_by_timestamp() for a file sorted by timestamp: bisects on byte offsets to the
+    start_date / end_date boundaries and copies the byte range in between.
+
+    Args:
+        input_file (str): Sorted log file (sorted_log.txt).
+        start_date (str): Start date in the format YYYY-MM-DD HH:MM:SS (inclusive).
+        end_date (str): End date in the format YYYY-MM-DD HH:MM:SS (inclusive).
+        output_file (str): Path of the trimmed file.
+    """
+    try:
+        start_key = start_date.encode('ascii')
+        end_key = end_date.encode('ascii')
+        file_size = os.path.getsize(input_file)
+        with open(input_file, 'rb') as infile:
+            start = bisect_sorted_log(infile, file_size, lambda timestamp: timestamp >= start_key)
+            end = bisect_sorted_log(infile, file_size, lambda timestamp: timestamp > end_key)
+        copy_file_range(input_file, output_file, start, max(start, end))
+        print(f"Filtered log saved to {output_file}")
+    except Exception as e:
+        print(f"Error: {e}")
+
+
+# Sparse timestamp index of sorted_log.txt: the epoch-microsecond key and byte offset of every
+# INDEX_EVERY-th line, stored as native int64 arrays after a small header.
+INDEX_EVERY = 1024
+INDEX_MAGIC = b'TTIDX001'
+INDEX_SUFFIX = '.idx'
+
+def canonical_timestamp_key(text):
+    """Epoch-microsecond key of a line starting with a canonical '%Y-%m-%d %H:%M:%S.%f' timestamp."""
+    return timestamp_key(parse_fixed_datetime_fraction(text[:26]))
+
+def new_sorted_log_index(every=INDEX_EVERY):
+    return {'every': every, 'lines': 0, 'keys': array.array('q'), 'offsets': array.array('q')}
+
+def add_to_sorted_log_index(index, line, position, key=None):
+    """
+    Records line (written at byte position) when it falls on the index interval.
+    key is the line's epoch-microsecond key when the caller already has it.
+    """
+    if index['lines'] % index['every'] == 0:
+        index['keys'].append(canonical_timestamp_key(line) if key is None else key)
+        index['offsets'].append(position)
+    index['lines'] += 1
+
+def write_sorted_log_index(index, index_file):
+    header = array.array('q', [index['every'], len(index['keys'])])
+    with open(index_file, 'wb') as outfile:
+        outfile.write(INDEX_MAGIC)
+        header.tofile(outfile)
+        index['keys'].tofile(outfile)
+        index['offsets'].tofile(outfile)
+
+def read_sorted_log_index(index_file):
+    """Loads an index file, returning its (keys, offsets) int64 arrays."""
+    with open(index_file, 'rb') as infile:
+        if infile.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            raise ValueError(f"'{index_file}' is not a techTool index")
+        header = array.array('q')
+        header.fromfile(infile, 2)
+        keys, offsets = array.array('q'), array.array('q')
+        keys.fromfile(infile, header[1])
+        offsets.fromfile(infile, header[1])
+    return keys, offsets
+
+def indexed_line_start(infile, keys, offsets, key, is_after):
+    """
+    Byte offset of the first line for which is_after(timestamp) is true: the index narrows
+    the search to one interval of INDEX_EVERY lines, which is then scanned.
+    """
+    slot = bisect.bisect_left(keys, key)
+    position = offsets[slot - 1] if slot > 0 else 0
+    while True:
+        position, timestamp = next_line_start(infile, position)
+        if position is None or is_after(timestamp):
+            return position
+        position += 1
+
+def query_sorted_log(output_path, start_date, end_date, output_file=None):
+    """
+    Copies the start_date..end_date window (inclusive, second resolution) of an existing
+    sorted_log.txt to output_file, or to stdout. Uses the index when there is one.
+    """
+    input_file = os.path.join(output_path, 'sorted_log.txt')
+    index_file = input_file + INDEX_SUFFIX
+    start_key = start_date.encode('ascii')
+    end_key = end_date.encode('ascii')
+    file_size = os.path.getsize(input_file)
+
+    with open(input_file, 'rb') as infile:
+        is_start = lambda timestamp: timestamp >= start_key
+        is_end = lambda timestamp: timestamp > end_key
+        if os.path.isfile(index_file):
+            keys, offsets = read_sorted_log_index(index_file)
+            start = indexed_line_start(infile, keys, offsets, canonical_timestamp_key(start_date + '.000000'), is_start)
+            end = indexed_line_start(infile, keys, offsets, canonical_timestamp_key(end_date + '.999999'), is_end)
+        else:
+            start = bisect_sorted_log(infile, file_size, is_start)
+            end = bisect_sorted_log(infile, file_size, is_end)
+        start = file_size if start is None else start
+        end = file_size if end is None else end
+
+        if output_file is not None:
+            copy_file_range(input_file, output_file, start, max(start, end))
+            return
+        infile.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = infile.read(min(READ_BUFFER_SIZE, remaining))
+            if not chunk:
+                break
+            sys.stdout.buffer.write(chunk)
+            remaining -= len(chunk)
+        sys.stdout.flush()
+
+def query_main(argv):
+    """'query' subcommand: slices an already processed output_path by time, without reprocessing."""
+    parser = argparse.ArgumentParser(prog='techTool.py query', description='Query a time window of a processed bundle.')
+    parser.add_argument('--output_path', type=validate_directory, required=True,
+                        help='Output directory of a previous run (holding sorted_log.txt)')
+    parser.add_argument('--start_date', type=valid_date, default="1999-01-01 00:00:00",
+                        help='Start date in the format YYYY-MM-DD HH:MM:SS')
+    parser.add_argument('--end_date', type=valid_date, default="2222-12-31 23:59:59",
+                        help='End date in the format YYYY-MM-DD HH:MM:SS')
+    parser.add_argument('--output_file', type=str, default=None,
+                        help='Write the window to this file instead of stdout')
+    args = parser.parse_args(argv)
+    query_sorted_log(str(args.output_path), str(args.start_date), str(args.end_date), args.output_file)
+
+# Token index of sorted_log.txt (--search_index), for the 'search' subcommand. The blocks are the
+# intervals of the sparse timestamp index (INDEX_EVERY lines), so a block's byte range and time range
+# come from the .idx file. Tokens are the lowercased ASCII word runs ([0-9a-z_]) that are not pure numbers,
+# each with the sorted uint32 ids of the blocks it appears in.
+# Layout: SEARCH_MAGIC, the entries (token length byte, token, block ids), the int64 entry offsets
+# (one more than the entries) and a trailer of int64 [entries, blocks, sorted_log size, source width].
+# A search only reads the blocks holding all its terms inside its time window; the lines of those
+# blocks are then checked, so tokens the index leaves out only cost extra blocks.
+SEARCH_MAGIC = b'TTTOK001'
+SEARCH_SUFFIX = '.tok'
+# Lowercases ASCII letters and turns every other non word byte into a space, so a split() tokenizes
+SEARCH_TOKEN_BYTES = bytes(character + 32 if 65 <= character <= 90 else
+                           character if 97 <= character <= 122 or 48 <= character <= 57 or character == 95 else 32
+                           for character in range(256))
+SEARCH_TOKEN_MAX = 64          # Longer tokens (hashes, dumps) are not indexed
+SEARCH_SPILL_TOKENS = 1 << 20  # Distinct tokens held in memory before they are spilled to a sorted run
+SEARCH_TRAILER = 4
+
+def search_tokens(data):
+    """The indexed tokens of a bytes string."""
+    return {token for token in set(data.translate(SEARCH_TOKEN_BYTES).split())
+            if 2 <= len(token) <= SEARCH_TOKEN_MAX and not token.isdigit()}
+
+def source_column_width():
+    """Width of the source column of sorted_log.txt: file_base, preceded by the node id with several bundles."""
+    return 32 + (len(NODES[0][1]) + 1 if NODES else 0)
+
+def read_search_index(search_file):
+    """Opens a token index, returning (mmap, entry offsets, trailer dict), or None when it is missing or invalid."""
+    try:
+        with open(search_file, 'rb') as infile:
+            mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(mapped) < len(SEARCH_MAGIC) + 8 * (SEARCH_TRAILER + 1):
+        mapped.close()
+        logging.warning(f"'{search_file}' is not a techTool token index")
+        return None
+    trailer = array.array('q', mapped[len(mapped) - 8 * SEARCH_TRAILER:])
+    entries, blocks, size, source_width = trailer
+    table_start = len(mapped) - 8 * (SEARCH_TRAILER + entries + 1)
+    if mapped[:len(SEARCH_MAGIC)] != SEARCH_MAGIC or not len(SEARCH_MAGIC) <= table_start < len(mapped):
+        mapped.close()
+        logging.warning(f"'{search_file}' is not a techTool token index")
+        return None
+    offsets = array.array('q', mapped[table_start:table_start + 8 * (entries + 1)])
+    return mapped, offsets, {'blocks': blocks, 'size': size, 'source_width': source_width}
+
+def search_index_entry(mapped, offsets, entry):
+    """(token, block ids as bytes) of an entry."""
+    start = offsets[entry]
+    token_end = start + 1 + mapped[start]
+    return mapped[start + 1:token_end], mapped[token_end:offsets[entry + 1]]
+
+def iter_search_index(search_file):
+    """Yields the (token, block ids bytes) entries of a token index (or of a spilled run) in token order."""
+    mapped, offsets, _ = read_search_index(search_file)
+    with mapped:
+        for entry in range(len(offsets) - 1):
+            yield search_index_entry(mapped, offsets, entry)
+
+def lookup_search_token(mapped, offsets, token):
+    """Block ids (array 'I') of a token, empty when the index does not have it."""
+    low, high = 0, len(offsets) - 1
+    while low < high:
+        middle = (low + high) // 2
+        start = offsets[middle]
+        if mapped[start + 1:start + 1 + mapped[start]] < token:
+            low = middle + 1
+        else:
+            high = middle
+    block_ids = array.array('I')
+    if low < len(offsets) - 1:
+        entry_token, data = search_index_entry(mapped, offsets, low)
+        if entry_token == token:
+            block_ids.frombytes(data)
+    return block_ids
+
+def write_search_index(entries, search_file, blocks=0, size=0, source_width=0):
+    """Writes (token, block ids bytes) entries, in token order, as a token index."""
+    offsets = array.array('q')
+    with open(search_file + '.tmp', 'wb', buffering=READ_BUFFER_SIZE) as outfile:
+        outfile.write(SEARCH_MAGIC)
+        position = len(SEARCH_MAGIC)
+        for token, data in entries:
+            offsets.append(position)
+            outfile.write(bytes([len(token)]) + token)
+            outfile.write(data)
+            position += 1 + len(token) + len(data)
+        offsets.append(position)
+        offsets.tofile(outfile)
+        array.array('q', [len(offsets) - 1, blocks, size, source_width]).tofile(outfile)
+    os.replace(search_file + '.tmp', search_file)
+
+def merge_search_runs(runs):
+    """
+    Merges token indexes covering consecutive block ranges (given in block order) into one entry stream.
+    A block present at the end of a run and the start of the next one (re-indexed) is kept once.
+    """
+    merged = heapq.merge(*(iter_search_index(run) for run in runs), key=operator.itemgetter(0))
+    for token, group in itertools.groupby(merged, key=operator.itemgetter(0)):
+        block_ids = array.array('I')
+        for _, data in group:
+            run_ids = array.array('I')
+            run_ids.frombytes(data)
+            if block_ids and run_ids and block_ids[-1] == run_ids[0]:
+                del run_ids[0]
+            block_ids.extend(run_ids)
+        yield token, block_ids.tobytes()
+
+def build_search_index(input_file, index_file, search_file, changed_from=0):
+    """
+    Writes the token index of input_file (sorted_log.txt) along its sparse timestamp index.
+    changed_from is the size of input_file the existing token index can still be used up to (lines
+    were only appended after it, --incremental); the blocks from its last one on are then indexed
+    and merged into it instead of reading the whole file.
+    """
+    keys, offsets = read_sorted_log_index(index_file)
+    size = os.path.getsize(input_file)
+    first_block, runs = 0, []
+    previous = read_search_index(search_file) if changed_from else None
+    if previous is not None:
+        previous[0].close()
+        trailer = previous[2]
+        if trailer['size'] == changed_from and trailer['source_width'] == source_column_width():
+            if trailer['size'] == size and trailer['blocks'] == len(keys):
+                return
+            first_block, runs = max(trailer['blocks'] - 1, 0), [search_file]
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(search_file))) as tmp_dir:
+        postings = {}
+
+        def spill():
+            run = os.path.join(tmp_dir, f"run_{len(runs):06d}{SEARCH_SUFFIX}")
+            write_search_index(((token, postings[token].tobytes()) for token in sorted(postings)), run)
+            runs.append(run)
+            postings.clear()
+
+        with open(input_file, 'rb') as infile:
+            if first_block < len(offsets):
+                infile.seek(offsets[first_block])
+            for block in range(first_block, len(offsets)):
+                end = offsets[block + 1] if block + 1 < len(offsets) else size
+                for token in search_tokens(infile.read(end - offsets[block])):
+                    block_ids = postings.get(token)
+                    if block_ids is None:
+                        postings[token] = block_ids = array.array('I')
+                    block_ids.append(block)
+                if len(postings) >= SEARCH_SPILL_TOKENS:
+                    spill()
+        if runs:
+            if postings:
+                spill()
+            entries = merge_search_runs(runs)
+        else:
+            entries = ((token, postings[token].tobytes()) for token in sorted(postings))
+        write_search_index(entries, search_file, len(keys), size, source_column_width())
+
+def term_pattern(term):
+    """Case-insensitive match of a term (a word or a phrase) starting and ending on ASCII word boundaries."""
+    return re.compile(rb"(?<![0-9A-Za-z_])" + re.escape(term.encode('utf-8')) + rb"(?![0-9A-Za-z_])", re.IGNORECASE)
+
+def candidate_blocks(search_index, terms, any_term):
+    """
+    Sorted ids of the blocks that can hold a match of the terms (all of them, or any with any_term),
+    None when the index cannot narrow the search (no indexed token in a term).
+    """
+    mapped, offsets, _ = search_index
+    term_blocks = []
+    for term in terms:
+        tokens = search_tokens(term.encode('utf-8'))
+        if not tokens:
+            if any_term:
+                return None
+            continue
+        # Every token of a term is a whole token of a matching line
+        blocks = None
+        for token in tokens:
+            token_blocks = set(lookup_search_token(mapped, offsets, token))
+            blocks = token_blocks if blocks is None else blocks & token_blocks
+        term_blocks.append(blocks)
+    if not term_blocks:
+        return None
+    blocks = set().union(*term_blocks) if any_term else set.intersection(*term_blocks)
+    return sorted(blocks)
+
+def iter_block_ranges(blocks, offsets, size):
+    """Merges consecutive block ids into (start, end) byte ranges of sorted_log.txt."""
+    start = end = None
+    for block in blocks:
+        block_start = offsets[block]
+        block_end = offsets[block + 1] if block + 1 < len(offsets) else size
+        if start is not None and block_start == end:
+            end = block_end
+            continue
+        if start is not None:
+            yield start, end
+        start, end = block_start, block_end
+    if start is not None:
+        yield start, end
+
+def record_bounds(data, position):
+    """(start, end) of the record holding byte position: its line and the '\t' continuation lines after it."""
+    start = data.rfind(b'\n', 0, position) + 1
+    while start > 0 and data[start] == 9:   # '\t'
+        start = data.rfind(b'\n', 0, start - 1) + 1
+    end = data.find(b'\n', position) + 1 or len(data)
+    while end < len(data) and data[end] == 9:
+        end = data.find(b'\n', end) + 1 or len(data)
+    return start, end
+
+def iter_candidate_lines(data, needles=()):
+    """
+    The records (lines, with their continuation lines) of data, or only those holding one of the
+    needles (lowercase bytes, matched case-insensitively). A literal find over the whole block is
+    much cheaper than checking every line.
+    """
+    if not needles:
+        start = 0
+        while start < len(data):
+            _, end = record_bounds(data, start)
+            yield data[start:end]
+            start = end
+        return
+    lowered = data.lower()
+    bounds = set()
+    for needle in needles:
+        position = lowered.find(needle)
+        while position >= 0:
+            start, end = record_bounds(data, position)
+            bounds.add((start, end))
+            position = lowered.find(needle, end)
+    for start, end in sorted(bounds):
+        yield data[start:end]
+
+def search_sorted_log(output_path, terms, regex=None, start_date="1999-01-01 00:00:00",
+                      end_date="2222-12-31 23:59:59", sources=(), any_term=False, output_file=None, count=False):
+    """
+    Writes the lines of output_path/sorted_log.txt in the start_date..end_date window (inclusive,
+    second resolution) whose message holds the terms (all of them, or any with any_term; whole words
+    or phrases, case-insensitive) and matches regex, from the source files matching sources (substrings
+    or globs of the source column: the base name of the file as log_base_name() gives it, cut to 32
+    characters and preceded by the node id with several bundles - not the full path). Only the blocks the token index and the time index select are read.
+    With count only the number of matching lines is printed. Returns the number of matching lines.
+    Without a token index every block of the window is read, and the source column is taken to be
+    the single bundle one (the index records its width with several bundles).
+    """
+    input_file = os.path.join(output_path, 'sorted_log.txt')
+    index_file = input_file + INDEX_SUFFIX
+    size = os.path.getsize(input_file)
+    if os.path.isfile(index_file):
+        keys, offsets = read_sorted_log_index(index_file)
+    else:
+        keys, offsets = array.array('q'), array.array('q', [0])
+    blocks = range(len(offsets)) if size else range(0)
+    source_width = source_column_width()
+
+    search_index = read_search_index(input_file + SEARCH_SUFFIX)
+    if search_index is not None and (search_index[2]['size'] != size or search_index[2]['blocks'] != len(keys)):
+        logging.warning(f"The token index does not match {input_file} (rebuild it with --search_index), scanning")
+        search_index[0].close()
+        search_index = None
+    elif search_index is None:
+        logging.warning(f"No token index for {input_file} (build it with --search_index), scanning")
+    if search_index is not None:
+        source_width = search_index[2]['source_width']
+        with search_index[0]:
+            selected = candidate_blocks(search_index, terms, any_term)
+        if selected is not None:
+            blocks = selected
+
+    # Blocks overlapping the window: block b holds keys[b] up to keys[b + 1]. Several blocks can start
+    # with the window start key, the block before the first of them can also hold lines of that key
+    if keys:
+        first = max(bisect.bisect_left(keys, canonical_timestamp_key(start_date + '.000000')) - 1, 0)
+        last = bisect.bisect_right(keys, canonical_timestamp_key(end_date + '.999999'))
+        blocks = [block for block in blocks if first <= block < last]
+
+    start_key, end_key = start_date.encode('ascii'), end_date.encode('ascii')
+    term_patterns = [term_pattern(term) for term in terms]
+    regex_pattern = re.compile(regex.encode('utf-8')) if regex else None
+    source_pattern = compile_path_patterns(sources)
+    # The lines worth checking hold the longest term (any term with any_term)
+    needles = [term.encode('utf-8').lower() for term in terms]
+    if needles and not any_term:
+        needles = [max(needles, key=len)]
+    matches = 0
+    if count:
+        outfile = contextlib.nullcontext()
+    elif output_file is not None:
+        outfile = open(output_file, 'wb')
+    else:
+        outfile = contextlib.nullcontext(sys.stdout.buffer)
+    with open(input_file, 'rb') as infile, outfile as outfile:
+        for start, end in iter_block_ranges(blocks, offsets, size):
+            infile.seek(start)
+            for line in iter_candidate_lines(infile.read(end - start), needles):
+                if not start_key <= line[:19] <= end_key:
+                    continue
+                source_start = 29 if line[26:27] == b'*' else 28
+                message = line[source_start + source_width + 1:]
+                if term_patterns:
+                    found = (pattern.search(message) for pattern in term_patterns)
+                    if not (any(found) if any_term else all(found)):
+                        continue
+                if regex_pattern is not None and not regex_pattern.search(message):
+                    continue
+                if source_pattern is not None and not source_pattern.search(
+                        line[source_start:source_start + source_width].decode('utf-8', errors='replace').strip()):
+                    continue
+                matches += 1
+                if outfile is not None:
+                    outfile.write(line)
+        if outfile is not None:
+            outfile.flush()
+    if count:
+        print(matches)
+    return matches
+
+def search_main(argv):
+    """'search' subcommand: term / regex search of a processed output_path through its token index."""
+    parser = argparse.ArgumentParser(prog='techTool.py search',
+                                     description='Search the lines of a processed bundle by terms, time and source file.')
+    parser.add_argument('terms', nargs='*',
+                        help='Words or quoted phrases the message must hold (case-insensitive, whole words)')
+    parser.add_argument('--output_path', type=validate_directory, required=True,
+                        help='Output directory of a previous run (holding sorted_log.txt and its .tok index)')
+    parser.add_argument('--any', action='store_true', help='Match lines holding any of the terms instead of all')
+    parser.add_argument('--regex', type=str, default=None, help='Regular expression the message must match')
+    parser.add_argument('--source', action='append', default=[],
+                        help='Only lines whose source column matches this substring or glob; the column holds the '
+                             'base name of the log (first 32 characters, without .gz/.bz2/.xz, preceded by the node '
+                             'id with several bundles), not its path - e.g. bgpd or "bgpd.trace*"; repeatable')
+    parser.add_argument('--start_date', type=valid_date, default="1999-01-01 00:00:00",
+                        help='Start date in the format YYYY-MM-DD HH:MM:SS')
+    parser.add_argument('--end_date', type=valid_date, default="2222-12-31 23:59:59",
+                        help='End date in the format YYYY-MM-DD HH:MM:SS')
+    parser.add_argument('--output_file', type=str, default=None,
+                        help='Write the matching lines to this file instead of stdout')
+    parser.add_argument('--count', action='store_true', help='Only print the number of matching lines')
+    args = parser.parse_args(argv)
+    if not args.terms and not args.regex:
+        parser.error("give at least one term or --regex (use the query subcommand for a time window)")
+    for source in args.source:
+        if '/' in source:
+            parser.error(f"--source '{source}': sorted_log.txt only holds the base name of the source files, "
+                         f"give a base name substring or glob (e.g. '{os.path.basename(source) or source}')")
+    search_sorted_log(str(args.output_path), args.terms, args.regex, str(args.start_date), str(args.end_date),
+                      args.source, args.any, args.output_file, args.count)
+
+# Incremental mode (--incremental): output_path keeps its sorted_log.txt, index and a state file
+# between runs. The state records per source file its inode, size, the byte offset parsed up to,
+# a fingerprint of its head and its last timestamp, so a run only parses the bytes appended since.
+# A file whose head changed (rotated or replaced) or a new one is parsed whole, minus the lines its
+# rotation family (the path without the '.N' / '.gz' suffixes) already merged up to that family's
+# watermark timestamp.
+INCREMENTAL_STATE = 'incremental_state.json'
+INCREMENTAL_VERSION = 1
+FINGERPRINT_BYTES = 4096
+ROTATION_SUFFIX = re.compile(r"(\.\d+)?(\.gz|\.bz2|\.xz)?$")
+
+def incremental_settings(change_hour, start_date, end_date, log_mode):
+    """Everything that changes the merged output; a state saved with other settings is rebuilt from scratch."""
+    return {
+        'version': INCREMENTAL_VERSION,
+        'parser': CACHE_VERSION,
+        'change_hour': int(change_hour),
+        'tz_rules': [rule for rule, _, _ in TIME_ZONE_RULES],
+        'nodes': [[node.rstrip(), offset] for _, node, offset in NODES],
+        'window': [start_date, end_date],
+        'log_mode': log_mode,
+    }
+
+def load_incremental_state(output_path, settings):
+    """
+    Returns the saved state of output_path, or a new empty one (and removes the previous outputs)
+    when there is none, it was saved with other settings or sorted_log.txt is gone.
+    """
+    state_file = os.path.join(output_path, INCREMENTAL_STATE)
+    try:
+        with open(state_file, 'r', encoding='utf-8') as infile:
+            state = json.load(infile)
+        if state.get('settings') == settings and os.path.isfile(os.path.join(output_path, 'sorted_log.txt')):
+            return state
+        logging.info(f"Incremental state of {output_path} does not match this run, rebuilding from scratch")
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable incremental state '{state_file}': {e}")
+    for name in ('sorted_log.txt', 'sorted_log.txt' + INDEX_SUFFIX, 'sorted_log.txt' + SEARCH_SUFFIX,
+                 'Trim_sorted_log.txt'):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(output_path, name))
+    return {'settings': settings, 'sources': {}, 'families': {}, 'sorted_lines': 0}
+
+def save_incremental_state(output_path, state):
+    state_file = os.path.join(output_path, INCREMENTAL_STATE)
+    with open(state_file + '.tmp', 'w', encoding='utf-8') as outfile:
+        json.dump(state, outfile, indent=1)
+    os.replace(state_file + '.tmp', state_file)
+
+def head_fingerprint(file_name, size):
+    """sha256 of the first size bytes of a file."""
+    with open(file_name, 'rb') as infile:
+        return hashlib.sha256(infile.read(size)).hexdigest()
+
+def complete_lines_end(file_name, start, end):
+    """Offset just after the last '\n' in [start, end) of a file, start when there is none (a line still being written)."""
+    with open(file_name, 'rb') as infile:
+        position = end
+        while position > start:
+            chunk_start = max(start, position - READ_BUFFER_SIZE)
+            infile.seek(chunk_start)
+            newline = infile.read(position - chunk_start).rfind(b'\n')
+            if newline >= 0:
+                return chunk_start + newline + 1
+            position = chunk_start
+    return start
+
+def rotation_family(file_name):
+    return ROTATION_SUFFIX.sub('', file_name, count=1)
+
+def unchanged_source(file_name, stat, entry):
+    """True when file_name is the file the state entry describes, grown or not (same head, not shorter)."""
+    return (entry is not None and stat.st_size >= entry['offset']
+            and head_fingerprint(file_name, entry['head']) == entry['fingerprint'])
+
+def iter_wip_lines(wip_file):
+    with open(wip_file, 'r', encoding='utf-8-sig', newline='') as infile:
+        yield from infile
+
+def drop_consumed_lines(wip_file, watermark, count):
+    """
+    Removes from a WIP file the lines its rotation family already merged: the lines before the
+    watermark timestamp and the first count lines at it. Returns wip_file, or None when no line is left.
+    """
+    kept = 0
+    with open(wip_file + '.tmp', 'w', encoding='utf-8', newline='', buffering=READ_BUFFER_SIZE) as outfile:
+        outfile.write('\ufeff')
+        for line in iter_wip_lines(wip_file):
+            timestamp = line[:26]
+            if timestamp < watermark:
+                continue
+            if timestamp == watermark and count > 0:
+                count -= 1
+                continue
+            outfile.write(line)
+            kept += 1
+    if not kept:
+        os.remove(wip_file + '.tmp')
+        os.remove(wip_file)
+        return None
+    os.replace(wip_file + '.tmp', wip_file)
+    return wip_file
+
+def highest_timestamp(wip_file):
+    """(highest timestamp, number of lines at it) of a WIP file."""
+    highest, count = '', 0
+    for line in iter_wip_lines(wip_file):
+        timestamp = line[:26]
+        if timestamp > highest:
+            highest, count = timestamp, 1
+        elif timestamp == highest:
+            count += 1
+    return highest, count
+
+def process_incremental_sources(files, change_hour, output_path, window, state):
+    """
+    Parses what is new in every file since the state was saved into WIP files (one per file, numbered
+    so files sharing a base name do not replace each other) and updates the state.
+
+    Returns:
+        list: The WIP files of this run's delta.
+    """
+    delta_files = []
+    previous_families = {name: dict(family) for name, family in state['families'].items()}
+    for file_name in files:
+        stat = os.stat(file_name)
+        entry = state['sources'].get(file_name)
+        compressed = os.path.splitext(file_name)[1] in COMPRESSED_LOG_OPENERS
+        if unchanged_source(file_name, stat, entry):
+            start = entry['offset']
+            if compressed or start == stat.st_size:
+                continue
+        else:
+            if entry is not None:
+                logging.info(f"'{file_name}' was rotated or replaced, parsing it again")
+            start = 0
+        end = stat.st_size if compressed else complete_lines_end(file_name, start, stat.st_size)
+        if end <= start and not compressed:
+            continue
+
+        print(f"Working on {file_name} (bytes {start} - {end})\n")
+        output_file_path = process_log_file(file_name, change_hour, output_path, window=window, mtime=stat.st_mtime,
+                                            byte_range=None if compressed else (start, end))
+        family_name = rotation_family(file_name)
+        family = previous_families.get(family_name)
+        if output_file_path is not None and start == 0 and family is not None:
+            output_file_path = drop_consumed_lines(output_file_path, family['watermark'], family['count'])
+
+        head = min(stat.st_size, FINGERPRINT_BYTES)
+        new_entry = {
+            'inode': stat.st_ino,
+            'size': stat.st_size,
+            'offset': end,
+            'head': head,
+            'fingerprint': head_fingerprint(file_name, head),
+            'last_timestamp': entry['last_timestamp'] if entry is not None and start else None,
+        }
+        if output_file_path is not None:
+            delta_path = os.path.join(os.path.dirname(output_file_path),
+                                      f"{len(delta_files):06d}_{os.path.basename(output_file_path)}")
+            os.replace(output_file_path, delta_path)
+            delta_files.append(delta_path)
+            highest, count = highest_timestamp(delta_path)
+            new_entry['last_timestamp'] = max(highest, new_entry['last_timestamp'] or '')
+            family = state['families'].setdefault(family_name, {'watermark': '', 'count': 0})
+            if highest > family['watermark']:
+                family['watermark'], family['count'] = highest, count
+            elif highest == family['watermark']:
+                family['count'] += count
+        state['sources'][file_name] = new_entry
+    return delta_files
+
+def last_line(file_name):
+    """The last line of a file as bytes, b'' for an empty file."""
+    with open(file_name, 'rb') as infile:
+        size = infile.seek(0, os.SEEK_END)
+        position = size
+        tail = b''
+        while position > 0:
+            position = max(0, position - READ_BUFFER_SIZE)
+            infile.seek(position)
+            tail = infile.read(size - position)
+            if tail.rfind(b'\n', 0, len(tail) - 1) >= 0:
+                break
+    return tail[tail.rfind(b'\n', 0, len(tail) - 1) + 1:]
+
+def merge_incremental(delta_files, output_file, index_file, state, memory_budget=None):
+    """
+    Merges the delta WIP files into output_file and its index. A delta starting at or after the
+    last line of output_file (the usual case) is appended and the index extended; otherwise
+    output_file and its index are rewritten by a single streaming merge.
+    Lines of the delta sort after existing lines with the same timestamp.
+    Returns the size output_file is unchanged up to (0 when it was rewritten).
+    """
+    if not os.path.isfile(output_file):
+        merge_sorted_files(delta_files, output_file, memory_budget, index_file=index_file)
+        with open(output_file, 'rb') as infile:
+            state['sorted_lines'] = sum(1 for _ in infile)
+        return 0
+    changed_from = os.path.getsize(output_file)
+    if not delta_files:
+        return changed_from
+
+    delta_file = output_file + '.delta'
+    merge_sorted_files(delta_files, delta_file, memory_budget)
+    with open(delta_file, 'rb') as infile:
+        first_line = infile.readline()
+    try:
+        if first_line[:27] >= last_line(output_file)[:27]:
+            keys, offsets = read_sorted_log_index(index_file)
+            index = new_sorted_log_index()
+            index['keys'], index['offsets'], index['lines'] = keys, offsets, state['sorted_lines']
+            with open(output_file, 'ab', buffering=READ_BUFFER_SIZE) as outfile, open(delta_file, 'rb') as infile:
+                position = outfile.tell()
+                for line in infile:
+                    add_to_sorted_log_index(index, line[:26].decode('ascii'), position)
+                    outfile.write(line)
+                    position += len(line)
+            write_sorted_log_index(index, index_file)
+            state['sorted_lines'] = index['lines']
+        else:
+            logging.info("The new lines interleave with the sorted log, merging them in")
+            merge_sorted_files([output_file, delta_file], output_file + '.merged', memory_budget,
+                               index_file=index_file + '.merged')
+            os.replace(output_file + '.merged', output_file)
+            os.replace(index_file + '.merged', index_file)
+            with open(delta_file, 'rb') as infile:
+                state['sorted_lines'] += sum(1 for _ in infile)
+            changed_from = 0
+    finally:
+        os.remove(delta_file)
+    return changed_from
+
 # Filter the files - Assuming all_files and normalized_external_files are defined
      
 def filter_files(all_files, external_list_of_files ):
+    exclude = compile_path_patterns(external_list_of_files)
     filtered_files = []
     
 
     for file in all_files:
-        if os.path.getsize(file) >= 200: # Ignore samll files <200 Bytes
-            if not any(part in file for part in external_list_of_files):
+        if os.path.getsize(file) >= MIN_LOG_FILE_SIZE: # Ignore samll files <200 Bytes
+            if exclude is None or not exclude.search(file):
                 filtered_files.append(file)
     
     return filtered_files
 
 def filter_files_min(all_files, min_list_of_files):
+    include = compile_path_patterns(min_list_of_files)
     filtered_files = []
     
 
     for file in all_files:
-        if os.path.getsize(file) >= 200: # Ignore samll files <200 Bytes
-            if any(part in file for part in min_list_of_files):
+        if os.path.getsize(file) >= MIN_LOG_FILE_SIZE: # Ignore samll files <200 Bytes
+            if include is not None and include.search(file):
                 filtered_files.append(file)
     
     return filtered_files
@@ -504,28 +3265,83 @@ def validate_tar_file(path):
         raise argparse.ArgumentTypeError(f"Not a valid .tar.gz file: '{path}'.")
     return path
 
+def validate_time_zone_rule(rule):
+    try:
+        parse_time_zone_rule(rule)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"Not a valid time zone rule: {e}.")
+    return rule
+
+def validate_node_offset(value):
+    node, _, seconds = value.partition('=')
+    try:
+        return node.strip(), float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Not a valid node offset (NODE=SECONDS): '{value}'.")
+
 def validate_directory(path):
     if not os.path.isdir(path):
         raise argparse.ArgumentTypeError(f"Not a valid directory: '{path}'.")
     return path
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'query':
+        return query_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'search':
+        return search_main(sys.argv[2:])
+
     parser = argparse.ArgumentParser(description='Process some parameters.')
     
-    parser.add_argument('--tar_file', type=validate_tar_file, default='/dt_bug_info/EM-5521/TC03_QosDSCP2EXPmarkingSubinterface-logs-2024.05.12-06.37.39.tar.gz',
-                        help='Full path to the .tar.gz file')
+    parser.add_argument('--tar_file', type=validate_tar_file, nargs='+', default=['/dt_bug_info/EM-5521/TC03_QosDSCP2EXPmarkingSubinterface-logs-2024.05.12-06.37.39.tar.gz'],
+                        help='Full path to the .tar.gz file; several bundles (one per node) are merged into one timeline')
+    parser.add_argument('--node_names', nargs='+', default=None,
+                        help='Node id of every --tar_file bundle, in the same order (default n1, n2, ...)')
+    parser.add_argument('--node_offset', type=validate_node_offset, action='append', default=[],
+                        help='NODE=SECONDS: clock offset correction added to the timestamps of a node; repeatable')
     parser.add_argument('--output_path', type=validate_directory, default='/dt_bug_info/danny1/techTool',
                         help='Full path to the output directory')
     parser.add_argument('--expand_tree', type=validate_directory, default='/dt_bug_info/danny1/techTool',
                         help='Full path to expand the logs from')
-    parser.add_argument('--change_hour', type=int, default=3,
-                        help='Hour adjustment value')
+    parser.add_argument('--change_hour', type=int, default=0,
+                        help='Hours added to every timestamp (after the --tz_rule conversion to UTC)')
+    parser.add_argument('--tz_rule', type=validate_time_zone_rule, action='append', default=[],
+                        help='PATTERN=ZONE: timestamps of the files matching PATTERN (path substring or glob) are in '
+                             'ZONE (UTC, +HH:MM or an IANA name) and are converted to UTC; repeatable, first match wins')
     parser.add_argument('--start_date', type=valid_date, default="1999-01-01 00:00:00",
                         help='Start date in the format YYYY-MM-DD HH:MM:SS')
     parser.add_argument('--end_date', type=valid_date, default="2222-12-31 23:59:59",
                         help='End date in the format YYYY-MM-DD HH:MM:SS')
     parser.add_argument('--log_mode', type=str, default='max',
                         help='which file list to use')
+    parser.add_argument('--archive_mode', action='store_true',
+                        help='Read the logs straight out of the tar file instead of extracting it')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='Directory of the persistent cache of processed files (disabled when not set)')
+    parser.add_argument('--cache_size_mb', type=int, default=CACHE_MAX_MB,
+                        help='Max size of the cache, least recently used entries are evicted')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of worker processes for the per-file processing (0 = all CPUs, 1 = serial)')
+    parser.add_argument('--async_mode', action='store_true',
+                        help='Overlap reading/decompression, parsing and writing of the files (asyncio pipeline)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record time, CPU, bytes, lines and peak RSS per stage and per file (output_path/profile.json)')
+    parser.add_argument('--profile_dump', type=str, default=None,
+                        help='Also write cProfile stats of the run to this file (implies --profile)')
+    parser.add_argument('--intermediate', choices=['text', 'columnar'], default='text',
+                        help='Format of the per-file WIP outputs: text lines, or binary columns merged on integer keys')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Keep output_path between runs and only parse what was appended (or rotated in) since the '
+                             'last one, merging it into the existing sorted_log.txt (extracted files, serial)')
+    parser.add_argument('--multiline', action='store_true',
+                        help='Keep the lines without a timestamp (stack traces, dumps) as continuation lines of the '
+                             'record before them, instead of dropping them')
+    parser.add_argument('--multiline_max_kb', type=int, default=MULTILINE_MAX_KB,
+                        help='Max size of the continuation lines kept per record, the rest are counted in a marker line')
+    parser.add_argument('--sort_memory_mb', type=int, default=SORT_MEMORY_MB,
+                        help='Memory budget for sorting a processed file that is not in timestamp order; '
+                             'a larger file is sorted externally through temporary files')
+    parser.add_argument('--search_index', action='store_true',
+                        help='Also build the token index of sorted_log.txt (sorted_log.txt.tok) used by the search subcommand')
 
     args = parser.parse_args()
     
@@ -535,12 +3351,25 @@ def main():
     logging.info(f"Start Execution \n")
 
     print(f"tar_file: {args.tar_file}")
+    print(f"node_names: {args.node_names}")
+    print(f"node_offset: {args.node_offset}")
     print(f"output_path: {args.output_path}")
     print(f"expand_tree: {args.expand_tree}")
     print(f"change_hour: {args.change_hour}")
+    print(f"tz_rule: {args.tz_rule}")
     print(f"start_date: {args.start_date}")
     print(f"end_date: {args.end_date}")
     print(f"log_mode: {args.log_mode}")
+    print(f"jobs: {args.jobs}")
+    print(f"archive_mode: {args.archive_mode}")
+    print(f"cache_dir: {args.cache_dir}")
+    print(f"async_mode: {args.async_mode}")
+    print(f"profile: {args.profile}")
+    print(f"intermediate: {args.intermediate}")
+    print(f"incremental: {args.incremental}")
+    print(f"search_index: {args.search_index}")
+    print(f"sort_memory_mb: {args.sort_memory_mb}")
+    print(f"multiline: {args.multiline}")
 
 # Define the execution paramters
 # tar_file_path = path of tech support log file .tar.gz
@@ -554,13 +3383,88 @@ def main():
 
 
 
-    tar_file = str(args.tar_file)
+    tar_files = [str(tar_file) for tar_file in args.tar_file]
     output_path = str(args.output_path)
     expand_tree = str(args.expand_tree)
-    change_hour = str(args.change_hour)  # Change this to the desired hour adjustment
+    # Every bundle is (tar file, directory it is extracted to, expand_tree in it). A single bundle is
+    # extracted to output_path as before, several bundles to output_path/<node id> and the lines are
+    # tagged with the node id
+    nodes = []
+    if len(tar_files) == 1:
+        bundles = [(tar_files[0], output_path, expand_tree)]
+    else:
+        node_names = args.node_names or [f"n{index}" for index in range(1, len(tar_files) + 1)]
+        if len(node_names) != len(tar_files):
+            parser.error(f"--node_names has {len(node_names)} names for {len(tar_files)} bundles")
+        if len(set(node_names)) != len(node_names) or any(
+                not re.fullmatch(r"[\w.-]+", node) or node == "WIP" for node in node_names):
+            parser.error(f"--node_names must be unique names of letters, digits, '.', '-' or '_': {node_names}")
+        offsets = dict(args.node_offset)
+        unknown = set(offsets) - set(node_names)
+        if unknown:
+            parser.error(f"--node_offset of unknown nodes: {sorted(unknown)}")
+        tree = os.path.relpath(os.path.abspath(expand_tree), os.path.abspath(output_path))
+        if tree.startswith(os.pardir):
+            logging.warning("expand_tree is not under output_path, every bundle is expanded from its root")
+            tree = os.curdir
+        bundles = []
+        for tar_file, node in zip(tar_files, node_names):
+            root = os.path.join(output_path, node)
+            bundles.append((tar_file, root, os.path.normpath(os.path.join(root, tree))))
+            nodes.append((root, node, offsets.get(node, 0.0)))
+            print(f"node {node}: {tar_file}, offset {offsets.get(node, 0.0)}s")
+    if len(tar_files) == 1 and (args.node_names or args.node_offset):
+        logging.warning("--node_names and --node_offset are only used with several --tar_file bundles")
+    set_nodes(nodes)
+    change_hour = args.change_hour  # Change this to the desired hour adjustment
+    set_time_zone_rules(args.tz_rule)
     start_date = str(args.start_date)
     end_date = str(args.end_date)
     log_mode = str(args.log_mode)
+    jobs = args.jobs
+    archive_mode = args.archive_mode
+    async_mode = args.async_mode
+    cache_dir = os.path.abspath(args.cache_dir) if args.cache_dir else None
+    cache_size_mb = args.cache_size_mb
+    incremental = args.incremental
+    sort_memory = max(1, args.sort_memory_mb) * 1024 * 1024
+    if incremental:
+        # The delta is parsed serially from the extracted files, the state tracks byte offsets on disk
+        for option, used in (('--archive_mode', archive_mode), ('--async_mode', async_mode), ('--jobs', jobs != 1),
+                             ('--cache_dir', cache_dir is not None),
+                             ('--intermediate columnar', args.intermediate == 'columnar'),
+                             ('--multiline', args.multiline)):
+            if used:
+                logging.warning(f"{option} is not used with --incremental")
+        archive_mode = async_mode = False
+        jobs = 1
+        cache_dir = None
+        args.intermediate = 'text'
+        args.multiline = False
+    if args.multiline and async_mode:
+        # The records would span the batches of the pipeline
+        logging.warning("--async_mode is not used with --multiline")
+        async_mode = False
+    set_multiline(max(1, args.multiline_max_kb) * 1024 if args.multiline else 0)
+    if cache_dir is not None and async_mode:
+        logging.warning("--cache_dir is not used with --async_mode")
+        cache_dir = None
+    columnar = args.intermediate == 'columnar'
+    if columnar and async_mode:
+        logging.warning("--intermediate columnar is not used with --async_mode, the WIP files are text")
+        columnar = False
+    if columnar and cache_dir is not None:
+        logging.warning("--cache_dir is not used with --intermediate columnar")
+        cache_dir = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    profile_dump = args.profile_dump
+    if args.profile or profile_dump:
+        enable_profile()
+    profiler = None
+    if profile_dump:
+        profiler = cProfile.Profile()
+        profiler.enable()
 
     external_list_of_files = [
         "/vbox/cpm_image/root/var/log/exaware.event",
@@ -610,11 +3514,21 @@ def main():
     # Deleting previous files
     print(f"\n")
     logging.info(f"Delete previous files\n")
-    file_name = remove_directory(output_path)
-
-    # Extracting tar file
-    logging.info(f"Extracting tar file\n")
-    extract_tar_to_folder(tar_file, output_path)
+    stage = start_profile_stage('remove')
+    if incremental:
+        # Only the WIP files of the previous run, the outputs and the state are kept
+        shutil.rmtree(os.path.join(output_path, "WIP"), ignore_errors=True)
+    else:
+        file_name = remove_directory(output_path)
+    end_profile_stage(stage)
+
+    if not archive_mode:
+        # Extracting tar file
+        logging.info(f"Extracting tar file\n")
+        stage = start_profile_stage('extract', bytes_in=sum(path_size(tar_file) for tar_file in tar_files))
+        for tar_file, root, _ in bundles:
+            extract_tar_to_folder(tar_file, root)
+        end_profile_stage(stage, bytes_out=path_size(output_path) if stage is not None else None)
 
     # Specify the working path WIP under the output_path
     new_subdirectory = "WIP"
@@ -625,79 +3539,145 @@ def main():
     except OSError as e:
         print(f"Error creating working path: {e}")
 
-    # Get all files in a expand_tree - all / last_week 
-    all_files = get_all_files(expand_tree , last_week_relative=False)
-    filtered_files_byList = filter_files(all_files, external_list_of_files)
-    if log_mode == "min":  
-      filtered_files_byList = filter_files_min(filtered_files_byList, min_list_of_files)  
-
-    print(f"\nFilter filed by list")
-    for index, file in enumerate(filtered_files_byList, start=1):
-        print(f"{index}: {file}")
+    if archive_mode:
+        # Archive mode - the selected members are streamed out of the tar file
+        print(f"\n")
+        stage = start_profile_stage('process')
+        logging.info(f"Start processing the logs straight from {', '.join(tar_files)}\n\n")
+        if async_mode:
+            run_async_pipeline(itertools.chain.from_iterable(
+                                   iter_tar_events(tar_file, root, tree, external_list_of_files, min_list_of_files,
+                                                   log_mode, start_date) for tar_file, root, tree in bundles),
+                               change_hour, output_path, (start_date, end_date))
+        else:
+            for tar_file, root, tree in bundles:
+                process_tar_members(tar_file, output_path, tree, change_hour, external_list_of_files,
+                                    min_list_of_files, log_mode, start_date, end_date, cache_dir, columnar,
+                                    member_root=root)
+        filtered_files = []
+    else:
+        # Get all files in a expand_tree - one traversal applying the size and file list filters
+        exclude = compile_path_patterns(external_list_of_files)
+        include = compile_path_patterns(min_list_of_files) if log_mode == "min" else None
+        stage = start_profile_stage('scan')
+        scanned_files = [entry for _, _, tree in bundles
+                         for entry in scan_files(tree, exclude, include, min_size=MIN_LOG_FILE_SIZE)]
+        # Leave out this tool's own outputs, present when expand_tree holds output_path (--incremental)
+        output_files = {os.path.abspath(os.path.join(output_path, name)) for name in
+                        ('sorted_log.txt', 'sorted_log.txt' + INDEX_SUFFIX, 'sorted_log.txt' + SEARCH_SUFFIX,
+                         'Trim_sorted_log.txt', INCREMENTAL_STATE,
+                         PROFILE_REPORT)}
+        working_prefix = os.path.abspath(working_path) + os.sep
+        scanned_files = [(file, stat) for file, stat in scanned_files
+                         if os.path.abspath(file) not in output_files and not os.path.abspath(file).startswith(working_prefix)]
+        end_profile_stage(stage)
+        filtered_files_byList = [file for file, _ in scanned_files]
+
+        print(f"\nFilter filed by list")
+        for index, file in enumerate(filtered_files_byList, start=1):
+            print(f"{index}: {file}")
         
     
-    print(f"\nFilter filed by date")
-    filtered_files = filter_files_by_time(filtered_files_byList, start_date)
-    logging.info(f"List files founded in path {expand_tree} after {start_date}\n ")
-    for index, file in enumerate(filtered_files, start=1):
-        print(f"{index}: {file}")
+        print(f"\nFilter filed by date")
+        # The date filter uses the stat results cached by scan_files()
+        start_timestamp = datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S").timestamp()
+        filtered_files = [file for file, stat in scanned_files if stat.st_mtime > start_timestamp]
+        logging.info(f"List files founded in path {', '.join(tree for _, _, tree in bundles)} after {start_date}\n ")
+        for index, file in enumerate(filtered_files, start=1):
+            print(f"{index}: {file}")
         
 
-    for i, file in enumerate(filtered_files):
-        # print(f"     {file}")
-        # Check if the file contain with ".gz"
-        if ".gz" in file:
-            new_file = zcat(file)
-            filtered_files[i] = new_file
-
-    #print(f"\n")
-    #logging.info(f"Updated list of files after file decompression \n")
-    #for file in filtered_files:
-    #    print(f"     {file}")
-        #print(file)
-
-    print(f"\n")
-    logging.info(f"Start processing the filtered logs\n\n")
+        # Compressed files (.gz/.bz2/.xz) are streamed by read_log_file(), no zcat copy is needed
+
+        #print(f"\n")
+        #logging.info(f"Updated list of files after file decompression \n")
+        #for file in filtered_files:
+        #    print(f"     {file}")
+            #print(file)
+
+        print(f"\n")
+        logging.info(f"Start processing the filtered logs\n\n")
+        stage = start_profile_stage('process')
+        if incremental:
+            # Incremental mode - only the bytes added since the saved state are parsed
+            incremental_state = load_incremental_state(output_path, incremental_settings(change_hour, start_date,
+                                                                                         end_date, log_mode))
+            delta_files = process_incremental_sources([file for file in filtered_files if file is not None],
+                                                      change_hour, output_path, (start_date, end_date),
+                                                      incremental_state)
+            logging.info(f"{len(delta_files)} files have new lines\n")
+            filtered_files = []
+        elif async_mode:
+            # Async mode - reading, parsing and writing of consecutive files overlap
+            run_async_pipeline(iter_file_events([file for file in filtered_files if file is not None],
+                                                (start_date, end_date), change_hour),
+                               change_hour, output_path, (start_date, end_date))
+            filtered_files = []
+        elif jobs != 1:
+            # Parallel mode - per-file normalization on a process pool
+            process_files_parallel([file for file in filtered_files if file is not None], change_hour, output_path,
+                                   start_date, end_date, jobs or os.cpu_count(), cache_dir, columnar)
+            filtered_files = []
     filtered_files_copy = filtered_files.copy()  # Create a copy to iterate over while modifying original list
     for file in filtered_files_copy:
         if file is None:
             filtered_files.remove(file)
         else:
             print(f"Working on {file}\n")
-            process_log_file(file, change_hour, output_path)
-            filter_log_by_timestamp(file, start_date, end_date, file+".trimmed")
+            process_log_source(file, change_hour, output_path, cache_dir, (start_date, end_date), columnar)
             filtered_files.remove(file)
             #print_file_content(file)
+    if stage is not None:
+        end_profile_stage(stage, bytes_out=path_size(working_path), **file_profile_totals())
+
+    if cache_dir is not None:
+        stage = start_profile_stage('cache_evict')
+        evict_cache(cache_dir, cache_size_mb * 1024 * 1024)
+        end_profile_stage(stage)
 
 ### break here
 
     print(f"\n")
-    logging.info(f"Create combine file \n")
+    logging.info(f"Create Sorted file \n")
 
+    # Stream-merge the per-file outputs straight into the sorted file
     all_proccessed_files = get_all_files(working_path , last_week_relative=True)
-    # Read contents from all files
-    combined_contents = read_contents_from_files(all_proccessed_files)
-
-    # Write combined contents to a new file
-    output_combine_file = 'combined_log.txt'
-    output_combine_file = Path(output_path) / f"{output_combine_file}"
-
-    with open( output_combine_file , 'w') as output_file:
-        output_file.write("\n".join(combined_contents))
-    print(f"    Combined contents written to {output_combine_file}.\n")
-
-    logging.info(f"Create Sorted file \n")
-    #sort file by timetamp and save file 
-    input_file = os.path.join(output_path, 'combined_log.txt')  # Replace with your actual input file
     output_file = os.path.join(output_path,'sorted_log.txt')
-    reorder_lines(input_file, output_file)
+    trim_file = os.path.join(output_path,'Trim_sorted_log.txt')
+    stage = start_profile_stage('merge', bytes_in=path_size(working_path) if PROFILE is not None else None)
+    changed_from = 0
+    if incremental:
+        changed_from = merge_incremental(delta_files, output_file, output_file + INDEX_SUFFIX, incremental_state,
+                                         sort_memory)
+    elif columnar:
+        # The trimmed file is selected on the integer keys while merging, no trim pass is needed
+        merge_columnar_files(all_proccessed_files, output_file, sort_memory, index_file=output_file + INDEX_SUFFIX,
+                             trim=(start_date, end_date, trim_file))
+    else:
+        merge_sorted_files(all_proccessed_files, output_file, sort_memory, index_file=output_file + INDEX_SUFFIX)
+    end_profile_stage(stage, bytes_out=path_size(output_file) if stage is not None else None)
     print(f"    Sorted list is written to {output_file}.\n")
+    if args.search_index:
+        stage = start_profile_stage('search_index', bytes_in=path_size(output_file))
+        build_search_index(output_file, output_file + INDEX_SUFFIX, output_file + SEARCH_SUFFIX, changed_from)
+        end_profile_stage(stage, bytes_out=path_size(output_file + SEARCH_SUFFIX))
+        print(f"    Token index is written to {output_file + SEARCH_SUFFIX}.\n")
 
     logging.info(f"Trimed list is written to {output_file}-Starting from {start_date} & ends by {end_date}.\n")
-    #Trim file by start_date, end_date
-    input_file = os.path.join(output_path,'sorted_log.txt')
-    output_file = os.path.join(output_path,'Trim_sorted_log.txt')
-    filter_log_by_timestamp(input_file, start_date, end_date, output_file)
+    if not columnar:
+        #Trim file by start_date, end_date
+        input_file = os.path.join(output_path,'sorted_log.txt')
+        stage = start_profile_stage('trim', bytes_in=path_size(input_file))
+        trim_sorted_log(input_file, start_date, end_date, trim_file)
+        end_profile_stage(stage, bytes_out=path_size(trim_file))
+    if incremental:
+        save_incremental_state(output_path, incremental_state)
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_dump)
+        print(f"cProfile stats are written to {profile_dump} (python3 -m pstats {profile_dump})")
+    write_profile_report(output_path)
 
     logging.info(f"END of Execution \n\n\n")
 #================================================================================================================
@@ -712,6 +3692,8 @@ if __name__ == "__main__":
 
 
 # python3.8 techTool.py --start_date "2024-05-05 13:13:00" --end_date "2024-05-05 14:28:00"
+# python3.8 techTool.py query --output_path "/home/danny/ws/techTool/FIBMAN_down" --start_date "2024-05-05 13:05:00" --end_date "2024-05-05 13:07:00"
+# python3.8 techTool.py search --output_path "/home/danny/ws/techTool/FIBMAN_down" "BGP NOTIFICATION" --source bgpd --start_date "2024-05-05 13:00:00" --end_date "2024-05-05 14:00:00"
 # python script_name.py --tar_file "/path/to/your/tar_file.tar.gz" --output_path "/path/to/output" --expand_tree "/path/to/directory" --change_hour 5 --start_date "2024-05-05 12:00:00" --end_date "2024-05-05 13:00:00"
 
 # need to handle:
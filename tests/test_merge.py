@@ -0,0 +1,104 @@
+"""
+Regression tests of the merge of WIP files into sorted_log.txt.
+
+Usage:
+    python3 -m pytest tests
+"""
+import os
+import random
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import techTool
+
+
+def write_wip_file(path, count, seed):
+    """Writes a shuffled WIP file the way open_wip_file() does: a BOM, then normalized lines."""
+    rng = random.Random(seed)
+    start = datetime(2024, 5, 5, 4, 0, 0)
+    lines = []
+    for i in range(count):
+        moment = start + timedelta(milliseconds=rng.randint(0, 3600 * 1000))
+        line = f"{moment.strftime('%Y-%m-%d %H:%M:%S.%f')}{'*' if i % 7 == 0 else ' '} {'bgpd.trace':<32} message {i}\n"
+        if i % 11 == 0:
+            line += f"\t    at continuation {i}\n"
+        lines.append(line)
+    rng.shuffle(lines)
+    with open(path, 'w', encoding='utf-8') as outfile:
+        outfile.write('\ufeff')
+        outfile.writelines(lines)
+
+
+class ExternalSortTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def merge(self, inputs, memory_budget):
+        output = os.path.join(self.tmp.name, f"sorted_{memory_budget}.txt")
+        techTool.merge_sorted_files(inputs, output, memory_budget=memory_budget, index_file=output + '.idx')
+        with open(output, 'rb') as infile, open(output + '.idx', 'rb') as index_file:
+            return infile.read(), index_file.read()
+
+    def test_external_sort_matches_in_memory_sort(self):
+        inputs = [os.path.join(self.tmp.name, f"wip_{seed}") for seed in range(3)]
+        for seed, path in enumerate(inputs):
+            write_wip_file(path, 3000, seed)
+        in_memory = self.merge(inputs, 1 << 30)
+        # A budget this small sorts every input externally, spilling more key runs than are merged at once
+        external = self.merge(inputs, 1000)
+        self.assertFalse(external[0].startswith(b'\xef\xbb\xbf'))
+        # Plain comparisons, a diff of the two outputs would take minutes
+        self.assertTrue(external[0] == in_memory[0], "sorted_log.txt differs between the external and in-memory sort")
+        self.assertTrue(external[1] == in_memory[1], "the index differs between the external and in-memory sort")
+
+
+class ColumnarMergeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write_inputs(self, count):
+        """Writes count columnar WIP files, every third one unordered, and the same records as text WIP files."""
+        rng = random.Random(7)
+        columnar, text = [], []
+        for number in range(count):
+            source = f"file_{number}.trace".ljust(32).encode('utf-8')
+            keys = [techTool.timestamp_key((2024, 5, 5, 4, 0, 0, 0)) + rng.randint(0, 3600 * 1000000)
+                    for _ in range(200)]
+            if number % 3:
+                keys.sort()
+            records = [(key * 2, key, 0, source, f"message {number}.{i}".encode('utf-8')) for i, key in enumerate(keys)]
+            columnar.append(os.path.join(self.tmp.name, f"col_{number}"))
+            techTool.write_columnar_records(records, columnar[-1], source)
+            text.append(os.path.join(self.tmp.name, f"text_{number}"))
+            with open(text[-1], 'w', encoding='utf-8') as outfile:
+                outfile.write('\ufeff')
+                for _, key, _, _, message in records:
+                    second, microsecond = divmod(key, 1000000)
+                    moment = datetime(1970, 1, 1) + timedelta(seconds=second, microseconds=microsecond)
+                    outfile.write(f"{moment.strftime('%Y-%m-%d %H:%M:%S.%f')}  {source.decode()} {message.decode()}\n")
+        return columnar, text
+
+    def read(self, path):
+        with open(path, 'rb') as infile:
+            return infile.read()
+
+    def test_merge_passes_match_single_merge_and_text_path(self):
+        columnar, text = self.write_inputs(20)
+        single, passes, text_output = (os.path.join(self.tmp.name, name) for name in ("single", "passes", "text"))
+        techTool.merge_columnar_files(columnar, single)
+        # More runs than are merged at once, merged in two passes
+        with mock.patch.object(techTool, 'MERGE_MAX_OPEN_FILES', 3):
+            techTool.merge_columnar_files(columnar, passes)
+        techTool.merge_sorted_files(text, text_output)
+        self.assertTrue(self.read(passes) == self.read(single), "the merge passes change sorted_log.txt")
+        self.assertTrue(self.read(single) == self.read(text_output), "the columnar and text merges differ")
+
+
+if __name__ == "__main__":
+    unittest.main()
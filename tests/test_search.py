@@ -0,0 +1,63 @@
+"""
+Regression tests of the search subcommand against a plain scan of sorted_log.txt.
+
+Usage:
+    python3 -m pytest tests
+"""
+import os
+import re
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import techTool
+
+
+class SearchWindowTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        # Several index blocks start with the same key: 5000 lines share the window start second
+        lines = [f"2024-12-30 23:59:59.{i:06d}  {'bgpd.trace':<32} session keepalive {i}\n" for i in range(1000)]
+        lines += [f"2024-12-31 00:00:00.000000  {'bgpd.trace':<32} {'session keepalive' if i % 3 else 'route'} {i}\n"
+                  for i in range(5000)]
+        lines += [f"2024-12-31 00:00:{1 + i // 100:02d}.{i:06d}  {'nsm.trace':<32} session keepalive {i}\n"
+                  for i in range(1000)]
+        wip_file = os.path.join(self.tmp.name, "wip")
+        with open(wip_file, 'w', encoding='utf-8') as outfile:
+            outfile.write('\ufeff')
+            outfile.writelines(lines)
+        self.sorted_log = os.path.join(self.tmp.name, 'sorted_log.txt')
+        techTool.merge_sorted_files([wip_file], self.sorted_log, index_file=self.sorted_log + techTool.INDEX_SUFFIX)
+        techTool.build_search_index(self.sorted_log, self.sorted_log + techTool.INDEX_SUFFIX,
+                                    self.sorted_log + techTool.SEARCH_SUFFIX)
+
+    def scan(self, start_date, end_date, pattern):
+        """The lines of the window whose message matches pattern, by reading the whole file."""
+        with open(self.sorted_log, 'rb') as infile:
+            return [line for line in infile
+                    if start_date.encode() <= line[:19] <= end_date.encode() and re.search(pattern, line[61:])]
+
+    def search(self, start_date, end_date, terms=(), regex=None):
+        output_file = os.path.join(self.tmp.name, 'found.txt')
+        techTool.search_sorted_log(self.tmp.name, list(terms), regex, start_date, end_date, output_file=output_file)
+        with open(output_file, 'rb') as infile:
+            return infile.readlines()
+
+    def test_regex_search_at_shared_window_start(self):
+        start = end = "2024-12-31 00:00:00"
+        found = self.search(start, end, regex="route")
+        self.assertEqual(len(found), len(self.scan(start, end, rb"route")))
+        self.assertTrue(found == self.scan(start, end, rb"route"))
+
+    def test_term_search_from_shared_window_start(self):
+        start, end = "2024-12-31 00:00:00", "2024-12-31 12:00:00"
+        expected = self.scan(start, end, rb"(?i)\bsession keepalive\b")
+        found = self.search(start, end, terms=["session keepalive"])
+        self.assertEqual(len(found), len(expected))
+        self.assertTrue(found == expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Regression tests of the timestamp and record normalization of log files.
+
+Usage:
+    python3 -m pytest tests
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import techTool
+
+
+class YearInferenceTest(unittest.TestCase):
+    LINES = "Feb 28 10:00:00 host a\nFeb 29 10:00:00 host b\nMar  1 10:00:00 host c\n"
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def normalize(self, year):
+        """Normalized lines of a year-less syslog file last modified on Mar 2 of year."""
+        log_file = os.path.join(self.tmp.name, 'messages')
+        with open(log_file, 'w', encoding='utf-8') as outfile:
+            outfile.write(self.LINES)
+        mtime = time.mktime((year, 3, 2, 0, 0, 0, 0, 0, -1))
+        os.utime(log_file, (mtime, mtime))
+        output_file = techTool.process_log_file(log_file, 0, self.tmp.name)
+        with open(output_file, encoding='utf-8-sig') as infile:
+            return [line[:27] + line.split()[-1] for line in infile]
+
+    def test_feb_29_in_leap_year(self):
+        self.assertEqual(self.normalize(2024), ["2024-02-28 10:00:00.000000*a",
+                                                "2024-02-29 10:00:00.000000*b",
+                                                "2024-03-01 10:00:00.000000*c"])
+
+    def test_feb_29_in_non_leap_year(self):
+        self.assertEqual(self.normalize(2023), ["2023-02-28 10:00:00.000000*a",
+                                                "2023-03-01 10:00:00.000000*c"])
+
+
+class MultilineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        techTool.set_multiline(1024)
+        self.addCleanup(techTool.set_multiline, 0)
+
+    def test_continuation_lines_are_cleaned_like_the_message(self):
+        log_file = os.path.join(self.tmp.name, 'bgpd.trace')
+        with open(log_file, 'w', encoding='utf-8') as outfile:
+            outfile.write("2024-05-05 10:00:00,000 head; with; semis\n  at frame0; x\n2024-05-05 10:00:01,000 next\n")
+        output_file = techTool.process_log_file(log_file, 0, self.tmp.name)
+        with open(output_file, encoding='utf-8-sig') as infile:
+            self.assertEqual(infile.read(), f"2024-05-05 10:00:00.000000  {'bgpd.trace':<32} head with semis\n"
+                                            f"\t  at frame0 x\n"
+                                            f"2024-05-05 10:00:01.000000  {'bgpd.trace':<32} next\n")
+
+
+if __name__ == "__main__":
+    unittest.main()